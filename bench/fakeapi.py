@@ -0,0 +1,316 @@
+'''
+Local stand-in for the bandori.party and bandori database apis, for load
+testing and reproducing slow or failing upstreams without the network.
+
+    python -m bench.fakeapi [--port 8080] [--scale 1] [--latency 50] [--jitter 20]
+                            [--error-rate 0.05] [--error-status 500] [--page-size 100]
+                            [--fixtures DIR]
+
+It serves generated fixtures (see bench.synthetic), or the ones in --fixtures
+(one <collection>.json list per collection, anything missing is generated).
+Record real ones with `python -m bench.fakeapi --record DIR`.
+
+Point the bot at it with the urls it prints on startup:
+
+    BANDORI_PARTY_URL=http://localhost:8080/party/
+    BANDORI_GA_URL=http://localhost:8080/ga/
+    BANDORI_RES_URL=http://localhost:8080/res
+
+Song files (bgm) are served from BANDORI_RES_URL, so ;play and the audio
+cache download from it too. The bytes are filler unless --fixtures has a
+res/ folder with real files.
+'''
+from aiohttp import web
+from bench import synthetic
+from datetime import datetime, timedelta
+import argparse
+import aiohttp
+import asyncio
+import random
+import json
+import os
+
+
+PARTY = ('cards', 'members', 'events', 'costumes', 'items', 'areaitems', 'assets')
+GA = ('music', 'gacha')
+
+ASSET_TYPES = ['comic', 'background', 'stamp', 'title', 'interface', 'officialart']
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def millis(d):
+    return str(int((d - datetime(1970, 1, 1)).total_seconds() * 1000))
+
+
+def generate(scale=1, seed=0):
+    '''
+    {collection : list of api objects}, the same shape the real apis return.
+    '''
+    rng = random.Random(seed)
+    db = synthetic.database(scale, seed)
+    now = datetime.utcnow()
+    fixtures = {
+        'cards' : [card.data for card in db['cards']],
+        'members' : [member.data for member in db['members']],
+    }
+
+    # back to back events, 9 days each, the last but one is going on right now.
+    count = 100 * scale
+    first = now - timedelta(days=10 * (count - 1) - 5)
+    fixtures['events'] = [{
+        'id' : id,
+        'name' : synthetic.title(rng, 3),
+        'japanese_name' : synthetic.word(rng, 4),
+        'i_type' : rng.choice(['Normal', 'Challenge Live', 'VS Live', 'Live Goals']),
+        'image' : f'/res/event/{id}.png',
+        'english_image' : f'/res/event/{id}en.png',
+        'english_start_date' : (first + timedelta(days=10 * (id - 1))).strftime(DATE_FORMAT),
+        'english_end_date' : (first + timedelta(days=10 * (id - 1) + 9)).strftime(DATE_FORMAT),
+        'main_card' : rng.randint(1, len(db['cards'])),
+        'i_boost_attribute' : rng.choice(synthetic.ATTRIBUTES),
+        'boost_members' : rng.sample(range(1, len(db['members']) + 1), 5)
+    } for id in range(1, count + 1)]
+
+    fixtures['costumes'] = [{'id' : id, 'name' : synthetic.title(rng, 2), 'i_costume_type' : 'Live',
+                             'image' : f'/res/costume/{id}.png', 'member' : rng.randint(1, len(db['members']))}
+                            for id in range(1, 600 * scale + 1)]
+    fixtures['items'] = [{'id' : id, 'name' : synthetic.title(rng, 2), 'i_type' : 'Material',
+                          'm_description' : synthetic.title(rng, 8), 'image' : f'/res/item/{id}.png'}
+                         for id in range(1, 100 * scale + 1)]
+    fixtures['areaitems'] = [{'id' : id, 'name' : synthetic.title(rng, 2), 'image' : f'/res/area/{id}.png',
+                              'i_attribute' : rng.choice(synthetic.ATTRIBUTES)}
+                             for id in range(1, 150 * scale + 1)]
+    fixtures['assets'] = [{'id' : id, 'i_type' : rng.choice(ASSET_TYPES), 'name' : synthetic.title(rng, 2),
+                           'image' : f'/res/asset/{id}.png'}
+                          for id in range(1, 2000 * scale + 1)]
+
+    fixtures['music'] = [{
+        'musicId' : song.id,
+        'title' : song.title,
+        'bandId' : song.bandId,
+        'bandName' : song.band_name,
+        'bgmFile' : f'/assets/sound/bgm{song.id:03}.mp3',
+        'thumb' : f'/assets/musicjacket/{song.id}_thumb.png',
+        'jacket' : f'/assets/musicjacket/{song.id}.png',
+        'difficulty' : song.difficulty,
+        'howToGet' : song.how_to_get,
+        'lyricist' : song.lyricist,
+        'composer' : song.composer,
+        'arranger' : song.arranger,
+        'publishedAt' : song.published_at
+    } for song in db['songs']]
+
+    # a few gachas at a time, some of them going on now.
+    fixtures['gacha'] = []
+    for id in range(1, 300 * scale + 1):
+        start = now - timedelta(days=rng.randint(-10, 900))
+        fixtures['gacha'].append({
+            'gachaId' : id,
+            'gachaName' : synthetic.title(rng, 3),
+            'publishedAt' : millis(start),
+            'closedAt' : millis(start + timedelta(days=rng.choice([7, 10, 14]))),
+            'description' : synthetic.title(rng, 10),
+            'gachaType' : 'normal'
+        })
+
+    return fixtures
+
+
+def load_fixtures(path, scale, seed):
+    fixtures = generate(scale, seed)
+    if path:
+        for name in PARTY + GA:
+            file = os.path.join(path, name + '.json')
+            if os.path.isfile(file):
+                with open(file) as handle:
+                    fixtures[name] = json.load(handle)
+    return fixtures
+
+
+class FakeApi:
+    '''
+    The aiohttp app. Every request waits latency (+- jitter) ms, and fails
+    with error_status for error_rate of them.
+    '''
+
+    def __init__(self, fixtures, latency=0, jitter=0, error_rate=0.0, error_status=500,
+                 page_size=100, res_bytes=256 * 1024, res_path=None, seed=0):
+        self.fixtures = fixtures
+        self.by_id = {name : {obj.get('id') : obj for obj in objs} for name, objs in fixtures.items()
+                      if name in PARTY}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.page_size = page_size
+        self.res_bytes = res_bytes
+        self.res_path = res_path
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+        self.app = web.Application(middlewares=[self.conditions])
+        self.app.add_routes([
+            web.get('/party/{collection}/', self.party_list),
+            web.get('/party/{collection}/{id}', self.party_item),
+            web.get('/ga/{region}/music/', self.ga_list),
+            web.get('/ga/{region}/gacha/', self.ga_list),
+            web.get('/ga/{region}/gacha/current', self.ga_current_gachas),
+            web.get('/ga/{region}/event/', self.ga_current_event),
+            web.get('/res/{path:.*}', self.resource),
+            web.get('/stats', self.stats)
+        ])
+
+    @web.middleware
+    async def conditions(self, request, handler):
+        if request.path == '/stats':
+            return await handler(request)
+
+        self.requests += 1
+        delay = max(0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(delay / 1000)
+
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({'detail' : 'Fake error.'}, status=self.error_status)
+
+        return await handler(request)
+
+    def collection(self, request):
+        name = request.match_info.get('collection') or request.path.rstrip('/').rsplit('/', 1)[-1]
+        if name not in self.fixtures:
+            raise web.HTTPNotFound(text=json.dumps({'detail' : 'Not found.'}), content_type='application/json')
+        return name
+
+    async def party_list(self, request):
+        objs = self.fixtures[self.collection(request)]
+        page = int(request.query.get('page', 1))
+        start = (page - 1) * self.page_size
+        end = start + self.page_size
+
+        return web.json_response({
+            'count' : len(objs),
+            'next' : str(request.url.update_query(page=page + 1)) if end < len(objs) else None,
+            'previous' : str(request.url.update_query(page=page - 1)) if page > 1 else None,
+            'results' : objs[start:end]
+        })
+
+    async def party_item(self, request):
+        name = self.collection(request)
+        try:
+            obj = self.by_id[name][int(request.match_info['id'])]
+        except (KeyError, ValueError):
+            return web.json_response({'detail' : 'Not found.'}, status=404)
+        return web.json_response(obj)
+
+    async def ga_list(self, request):
+        objs = self.fixtures[self.collection(request)]
+        return web.json_response({'totalCount' : len(objs), 'data' : objs})
+
+    async def ga_current_gachas(self, request):
+        now = millis(datetime.utcnow())
+        active = [g for g in self.fixtures['gacha'] if int(g['publishedAt']) <= int(now) < int(g['closedAt'])]
+        return web.json_response({'totalCount' : len(active), 'data' : active})
+
+    async def ga_current_event(self, request):
+        now = datetime.utcnow().strftime(DATE_FORMAT)
+        current = [e for e in self.fixtures['events']
+                   if (e.get('english_start_date') or '') <= now < (e.get('english_end_date') or '')]
+        event = current[-1] if current else self.fixtures['events'][-1]
+        # the database's event ids are 3 behind bandori.party's.
+        return web.json_response({'eventId' : event['id'] - 3, 'eventName' : event.get('name')})
+
+    async def resource(self, request):
+        path = request.match_info['path']
+        if self.res_path:
+            root = os.path.realpath(self.res_path)
+            file = os.path.realpath(os.path.join(root, path))
+            # inside the res folder only, not a sibling like res-old/.
+            if file.startswith(root + os.sep) and os.path.isfile(file):
+                return web.FileResponse(file)
+
+        response = web.StreamResponse(headers={'Content-Type' : 'audio/mpeg' if path.endswith('.mp3') else 'image/png'})
+        response.content_length = self.res_bytes
+        await response.prepare(request)
+
+        chunk = b'\0' * 64 * 1024
+        sent = 0
+        while sent < self.res_bytes:
+            part = chunk[:self.res_bytes - sent]
+            await response.write(part)
+            sent += len(part)
+        return response
+
+    async def stats(self, request):
+        return web.json_response({'requests' : self.requests, 'errors' : self.errors})
+
+
+async def record(path, region='en/'):
+    '''
+    Save the real apis' responses as fixtures.
+    '''
+    party = 'https://bandori.party/api/'
+    ga = 'https://api.bandori.ga/v1/' + region
+    os.makedirs(path, exist_ok=True)
+
+    async with aiohttp.ClientSession() as session:
+        async def get(url):
+            async with session.get(url) as resp:
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+
+        for name in PARTY:
+            results, url = [], party + name + '/'
+            while url:
+                page = await get(url)
+                results.extend(page['results'])
+                url = page['next']
+            save(path, name, results)
+
+        for name in GA:
+            d = await get(ga + name + '/')
+            if isinstance(d, dict) and d.get('data') is not None:
+                d = d['data']
+            save(path, name, list(d.values()) if isinstance(d, dict) else d)
+
+
+def save(path, name, objs):
+    with open(os.path.join(path, name + '.json'), 'w') as handle:
+        json.dump(objs, handle)
+    print(f'Recorded {len(objs)} {name}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake bandori.party and bandori database apis.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scale', type=int, default=1, help='size of the generated fixtures, as a multiple of today\'s')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixtures', help='folder of <collection>.json fixtures (and res/ files) to serve')
+    parser.add_argument('--record', metavar='DIR', help='save the real apis\' data to DIR instead of serving')
+    parser.add_argument('--latency', type=float, default=0, help='ms added to every request')
+    parser.add_argument('--jitter', type=float, default=0, help='ms of random variation of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='status of the failed requests')
+    parser.add_argument('--page-size', type=int, default=100, help='results per bandori.party page')
+    parser.add_argument('--res-kb', type=int, default=256, help='size of the filler resource files')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        asyncio.get_event_loop().run_until_complete(record(args.record))
+        return
+
+    fixtures = load_fixtures(args.fixtures, args.scale, args.seed)
+    res_path = os.path.join(args.fixtures, 'res') if args.fixtures else None
+    api = FakeApi(fixtures, args.latency, args.jitter, args.error_rate, args.error_status,
+                  args.page_size, args.res_kb * 1024, res_path, args.seed)
+
+    base = f'http://{args.host}:{args.port}'
+    print(f'BANDORI_PARTY_URL={base}/party/\nBANDORI_GA_URL={base}/ga/\nBANDORI_RES_URL={base}/res')
+    print(', '.join(f'{len(objs)} {name}' for name, objs in fixtures.items()))
+    web.run_app(api.app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
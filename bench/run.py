@@ -0,0 +1,344 @@
+'''
+Offline benchmarks for the BandoriViewer hot paths: catalog lookups,
+filtering, name search, query parsing, paging, embed formatting and
+loading the db from disk. No discord connection or network is needed.
+
+    python -m bench.run                         # today's data size
+    python -m bench.run --scale 1 10 100        # and 10x, 100x of it
+    python -m bench.run --save bench/baseline.json
+    python -m bench.run --baseline bench/baseline.json
+
+With --baseline, benchmarks whose median got slower than the baseline by
+more than --threshold are reported and the exit code is 1.
+The embed benchmarks need discord.py installed, they are skipped otherwise.
+'''
+from bench import synthetic
+from utils.catalog import Catalog
+from utils.query import QueryParser, Option, integer, day, choice
+from utils.store import CollectionStore
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import random
+import json
+import time
+import sys
+
+# imported up front, so discord.py and the cog aren't counted as the db's memory in run().
+try:
+    from cogs.bandori import BandoriViewer
+except ImportError as e:
+    BandoriViewer = None
+    VIEWER_MISSING = f'needs the bot\'s dependencies ({e})'
+
+
+BENCHMARKS = []
+
+# slowdowns smaller than this are timer noise, not regressions.
+MIN_DELTA_US = 2.0
+
+
+def bench(name, batch=1):
+    '''
+    Registers a benchmark. The function gets the Env and returns the step to time,
+    batch is how many operations one step does (reported per step).
+    '''
+    def register(func):
+        BENCHMARKS.append((name, batch, func))
+        return func
+    return register
+
+
+class Env:
+    '''
+    Everything the benchmarks share for one scale.
+    '''
+
+    def __init__(self, scale, tmp):
+        self.scale = scale
+        self.rng = random.Random(1)
+        self.db = synthetic.database(scale)
+        self.catalog = Catalog(self.db)
+        self.store = CollectionStore(tmp)
+        self.store.save_all(self.db)
+
+        if BandoriViewer is None:
+            self.viewer = None
+            self.skip_reason = VIEWER_MISSING
+        else:
+            # only the formatting and paging helpers are used, no bot behind it.
+            self.viewer = BandoriViewer.__new__(BandoriViewer)
+            self.viewer.catalog = self.catalog
+
+
+def needs_viewer(func):
+    def wrapper(env):
+        if env.viewer is None:
+            raise Skip(env.skip_reason)
+        return func(env)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+class Skip(Exception):
+    pass
+
+
+##### catalog
+
+@bench('catalog_build')
+def catalog_build(env):
+    return lambda: Catalog(env.db)
+
+
+@bench('get_by_id', batch=100)
+def get_by_id(env):
+    ids = [env.rng.randint(1, len(env.db['cards'])) for _ in range(100)]
+    get = env.catalog.get
+    return lambda: [get('cards', id) for id in ids]
+
+
+@bench('find_by_name', batch=100)
+def find_by_name(env):
+    names = [env.rng.choice(env.db['cards']).name for _ in range(100)]
+    find = env.catalog.find
+    return lambda: [find('cards', name) for name in names]
+
+
+def typo(rng, name):
+    i = rng.randrange(len(name))
+    return name[:i] + name[i + 1:]
+
+
+@bench('search_fuzzy', batch=10)
+def search_fuzzy(env):
+    queries = [typo(env.rng, env.rng.choice(env.db['cards']).name) for _ in range(10)]
+    index = env.catalog.search['cards']
+    return lambda: [index.search(q) for q in queries]
+
+
+@bench('search_prefix', batch=10)
+def search_prefix(env):
+    queries = [env.rng.choice(env.db['cards']).name[:4] for _ in range(10)]
+    index = env.catalog.search['cards']
+    return lambda: [index.search(q) for q in queries]
+
+
+##### filtering
+
+CARD_PARSER = QueryParser('cards', [
+    Option('id', convert=integer),
+    Option('rarity', 'i_rarity', choice({r : r for r in (2, 3, 4)}), multi=True, ranged=True),
+    Option('attr', 'i_attribute', choice({a : a for a in synthetic.ATTRIBUTES}), multi=True),
+    Option('member', 'member', integer, multi=True),
+    Option('total', 'total', integer, ranged=True),
+    Option('release', 'release', day, ranged=True)
+], sorts={'total' : 'total', 'release' : 'release'})
+
+
+@bench('parse_query')
+def parse_query(env):
+    return lambda: CARD_PARSER.parse('--rarity 3..4 --attr !cool,pure --total 20000.. --sort -total')
+
+
+def uncached(env, text):
+    query = CARD_PARSER.parse(text)
+
+    def step():
+        env.catalog.query_cache.clear()
+        return env.catalog.query('cards', query.filters, query.sort)
+    return step
+
+
+@bench('query_equality')
+def query_equality(env):
+    return uncached(env, '--rarity 4 --attr cool')
+
+
+@bench('query_compound')
+def query_compound(env):
+    return uncached(env, '--rarity 3..4 --attr !cool,pure --member 1,2,3,4,5 --total 15000..')
+
+
+@bench('query_sorted')
+def query_sorted(env):
+    return uncached(env, '--release 2018-01-01..2019-12-31 --sort -total')
+
+
+@bench('query_cached')
+def query_cached(env):
+    query = CARD_PARSER.parse('--rarity 4 --attr cool')
+    env.catalog.query('cards', query.filters)
+    return lambda: env.catalog.query('cards', query.filters)
+
+
+##### paging and embeds
+
+@bench('page_logic')
+@needs_viewer
+def page_logic(env):
+    results = env.catalog.query('cards')
+    pages = len(results) // 10
+    return lambda: env.viewer.page_logic(env.rng.randint(0, pages), results)
+
+
+@bench('format_card')
+@needs_viewer
+def format_card(env):
+    card = env.db['cards'][0]
+    return lambda: env.viewer.format_card(card.data, True, 'Member (Band)')
+
+
+@bench('format_all_cards_embed')
+@needs_viewer
+def format_all_cards_embed(env):
+    results = env.catalog.query('cards')
+    return lambda: env.viewer.format_all_cards_embed(results, page=3)
+
+
+@bench('cached_embed')
+@needs_viewer
+def cached_embed(env):
+    card = env.db['cards'][0]
+    return lambda: env.viewer.cached_embed('cards', card, True, 'Member (Band)')
+
+
+##### disk
+
+def pickle_load(name):
+    return lambda env: (lambda: env.store.load(name))
+
+
+for name in ('cards', 'members', 'songs'):
+    bench(f'pickle_load_{name}')(pickle_load(name))
+
+
+##### running
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def measure(step, min_time=0.2, min_runs=5, max_runs=5000):
+    '''
+    Per-run durations in seconds, running for about min_time.
+    '''
+    times = []
+    started = time.perf_counter()
+
+    while len(times) < max_runs and (len(times) < min_runs or time.perf_counter() - started < min_time):
+        t = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - t)
+
+    return times
+
+
+def peak_memory(step, runs=3):
+    '''
+    Most memory (bytes) allocated at once while running the step, measured separately
+    from the timings since tracemalloc slows everything down.
+    '''
+    tracemalloc.start()
+    try:
+        for _ in range(runs):
+            step()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(scale, min_time, only=None):
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tracemalloc.start()
+        env = Env(scale, tmp)
+        db_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'\n## scale {scale}x: {len(env.db["cards"])} cards, {len(env.db["members"])} members, '
+              f'{len(env.db["songs"])} songs, db + catalog {db_size / 1024 / 1024:.1f} MiB')
+
+        for name, batch, make in BENCHMARKS:
+            if only and not any(o in name for o in only):
+                continue
+
+            try:
+                step = make(env)
+            except Skip as e:
+                print(f'{name:<26} skipped, {e}')
+                continue
+
+            step()  # warm up
+            times = sorted(measure(step, min_time))
+            result = {
+                'batch' : batch,
+                'runs' : len(times),
+                'mean_us' : sum(times) / len(times) * 1e6,
+                'p50_us' : percentile(times, 0.5) * 1e6,
+                'p90_us' : percentile(times, 0.9) * 1e6,
+                'p99_us' : percentile(times, 0.99) * 1e6,
+                'peak_kib' : peak_memory(step) / 1024
+            }
+            results[f'{name}@{scale}x'] = result
+
+            print(f'{name:<26} x{batch:<4} p50 {result["p50_us"]:>10.1f}us  p90 {result["p90_us"]:>10.1f}us  '
+                  f'p99 {result["p99_us"]:>10.1f}us  peak {result["peak_kib"]:>9.1f}KiB  ({result["runs"]} runs)')
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints the change of every benchmark against the baseline, returns the regressions.
+    '''
+    regressions = []
+    print(f'\n## against baseline (regression: median more than {threshold:.0%} slower)')
+
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            print(f'{key:<32} new')
+            continue
+
+        ratio = result['p50_us'] / before['p50_us'] if before['p50_us'] else 1
+        regressed = ratio > 1 + threshold and result['p50_us'] - before['p50_us'] > MIN_DELTA_US
+        if regressed:
+            regressions.append(key)
+        print(f'{key:<32} {before["p50_us"]:>10.1f}us -> {result["p50_us"]:>10.1f}us  {ratio - 1:>+7.1%}'
+              + ('  REGRESSION' if regressed else ''))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the bot\'s hot paths.')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1], help='data size, as a multiple of today\'s')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds to run each benchmark for')
+    parser.add_argument('--only', nargs='+', help='only run benchmarks whose name contains one of these')
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for scale in args.scale:
+        results.update(run(scale, args.min_time, args.only))
+
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump({'python' : platform.python_version(), 'results' : results}, handle, indent=2)
+        print(f'\nSaved results to {args.save}')
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
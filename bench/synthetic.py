@@ -0,0 +1,114 @@
+'''
+Synthetic bandori db for the benchmarks, shaped like the real one.
+
+Counts are roughly what the api has today, scaled by --scale, so the
+benchmarks can also show how the bot does with 10x or 100x the data.
+'''
+from datetime import date, timedelta
+from utils.records import CardRecord, MemberRecord, SongRecord
+import random
+
+
+CARDS = 1500
+MEMBERS = 35
+SONGS = 350
+
+ATTRIBUTES = ['Powerful', 'Cool', 'Pure', 'Happy']
+SKILL_TYPES = ['Score up', 'Life recovery', 'Perfect lock', 'Life guard']
+SCHOOL_YEARS = ['First', 'Second', 'Third']
+BANDS = ['Poppin\'Party', 'Afterglow', 'Hello, Happy World!', 'Pastel＊Palettes', 'Roselia', 'RAISE A SUILEN']
+
+SYLLABLES = ['ka', 'su', 'mi', 'ra', 'n', 'yu', 'ki', 'na', 'sa', 'yo', 'hi', 'to', 'ri', 'ko', 'mo', 'ta', 'e', 'a', 'ya', 'li']
+WORDS = ['Happy', 'Summer', 'Night', 'Star', 'Dream', 'Festival', 'Rose', 'Sky', 'Heart', 'Stage',
+         'Melody', 'Birthday', 'Sweet', 'Snow', 'Dance', 'Shining', 'Moon', 'Wish', 'Spring', 'Song']
+
+
+def word(rng, n=3):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(n)).capitalize()
+
+
+def title(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def members(rng, count):
+    return [MemberRecord.from_data({
+        'id' : id,
+        'name' : f'{word(rng)} {word(rng, 4)}',
+        'japanese_name' : word(rng),
+        'image' : f'https://example.com/m/{id}.png',
+        'square_image' : f'https://example.com/m/{id}s.png',
+        'i_band' : BANDS[id % len(BANDS)],
+        'school' : 'Hanasakigawa',
+        'i_school_year' : rng.choice(SCHOOL_YEARS),
+        'romaji_CV' : word(rng),
+        'CV' : word(rng),
+        'birthday' : '07-14',
+        'food_like' : word(rng),
+        'food_dislike' : word(rng),
+        'i_astrological_sign' : 'Cancer',
+        'instrument' : 'Guitar',
+        'description' : title(rng, 30)
+    }) for id in range(1, count + 1)]
+
+
+def cards(rng, count, member_count):
+    first = date(2017, 3, 16)
+    result = []
+
+    for id in range(1, count + 1):
+        rarity = rng.choice([2, 2, 3, 3, 3, 4])
+        stats = {stat : rng.randint(2000, 9000) for stat in ('performance', 'technique', 'visual')}
+
+        data = {
+            'id' : id,
+            'name' : title(rng, rng.randint(1, 3)),
+            'japanese_name' : word(rng, 4),
+            'member' : rng.randint(1, member_count),
+            'i_rarity' : rarity,
+            'i_attribute' : rng.choice(ATTRIBUTES),
+            'i_skill_type' : rng.choice(SKILL_TYPES),
+            'skill_name' : title(rng, 2),
+            'japanese_skill_name' : word(rng),
+            'full_skill' : title(rng, 12),
+            'image' : f'https://example.com/c/{id}.png',
+            'art' : f'https://example.com/c/{id}a.png',
+            'cameo_members' : [],
+            'is_promo' : False,
+            'is_original' : False,
+            'release_date' : (first + timedelta(days=id * 1500 // count)).isoformat()
+        }
+        for stat, value in stats.items():
+            data[f'{stat}_min'] = value // 3
+            data[f'{stat}_max'] = value
+            if rarity > 2:
+                data[f'{stat}_trained_max'] = value + 500
+        if rarity > 2:
+            data['image_trained'] = f'https://example.com/c/{id}t.png'
+            data['art_trained'] = f'https://example.com/c/{id}at.png'
+
+        result.append(CardRecord.from_data(data))
+
+    return result
+
+
+def songs(rng, count):
+    return [SongRecord(id, title(rng, rng.randint(1, 4)), rng.randint(1, len(BANDS)), rng.choice(BANDS),
+                       f'https://example.com/s/{id}.mp3', f'https://example.com/s/{id}t.png',
+                       f'https://example.com/s/{id}j.png', [rng.randint(5, 28) for _ in range(4)],
+                       'Default', word(rng), word(rng), word(rng), '1489640400000')
+            for id in range(1, count + 1)]
+
+
+def database(scale=1, seed=0):
+    '''
+    {collection : records} with today's counts times scale.
+    '''
+    rng = random.Random(seed)
+    member_count = MEMBERS * scale
+
+    return {
+        'cards' : cards(rng, CARDS * scale, member_count),
+        'members' : members(rng, member_count),
+        'songs' : songs(rng, SONGS * scale)
+    }
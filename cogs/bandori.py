@@ -2,20 +2,23 @@ import discord
 import logging
 import json
 import asyncio
-import argparse
-import aiohttp
 import sys
 import os
-import io
-import shutil
-import _pickle as pickle
-import youtube_dl
 from datetime import datetime
-from pydori import bandori_api
 from discord.ext import tasks, commands
 from discord.utils import get
 from discord.voice_client import VoiceClient
+from utils.catalog import Catalog
+from utils.rebuild import RebuildPipeline
+from utils.store import CollectionStore, LazyDatabase
+from utils.records import compact, is_compact
+from utils.player import GuildPlayer, BgmTrack, YoutubeTrack, DownloadTrack
+from utils.downloads import DownloadManager
+from utils.audiocache import AudioCache
+from utils.live import LiveInfo
+from utils.query import QueryParser, QueryError, Option, integer, day, choice, enum
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 
 logging.basicConfig(level = logging.WARNING, 
@@ -23,13 +26,6 @@ logging.basicConfig(level = logging.WARNING,
                     datefmt = '%Y-%m-%d %H:%M:%S')
 
 
-class ArgumentParser(argparse.ArgumentParser):
-
-    def error(self, message):
-        logging.debug(f'Error while parsing arguments: {message}')
-        #self.print_help(sys.stderr)
-        #self.exit(2, '%s: error: %s\n' % (self.prog, message))
-
 class BandoriViewer(commands.Cog):
     '''
     Bandori data viewer using pydori
@@ -43,6 +39,15 @@ class BandoriViewer(commands.Cog):
     '''
 
     DB_PATH = 'data/'
+    # play audio while it downloads instead of downloading whole files first.
+    STREAM_AUDIO = os.getenv('STREAM_AUDIO', 'true').lower() != 'false'
+    AUDIO_CACHE_MB = int(os.getenv('AUDIO_CACHE_MB', 512))
+    # how many of the most played songs to download when the cog loads, 0 for none.
+    AUDIO_CACHE_PREWARM = int(os.getenv('AUDIO_CACHE_PREWARM', 0))
+    PROGRESS_INTERVAL = 3 # seconds between download progress updates
+    # candidates shown when a name search has no exact match.
+    SEARCH_RESULTS = 5
+    WARM_COLLECTIONS = ['items', 'events', 'gachas']
     latest = datetime.now()
 
     rarity_colors = {
@@ -51,6 +56,21 @@ class BandoriViewer(commands.Cog):
         4 : 0xeff21d
     }
 
+    attributes = ['Powerful', 'Cool', 'Pure', 'Happy']
+
+    # --sort name : card column
+    card_sorts = {
+        'id' : 'id',
+        'rarity' : 'i_rarity',
+        'perf' : 'performance',
+        'tech' : 'technique',
+        'visual' : 'visual',
+        'total' : 'total',
+        'release' : 'release'
+    }
+
+    school_years = ['First', 'Second', 'Third']
+
     skilltypes = {
         0 : 'Score up',
         1 : 'Life recovery',
@@ -83,136 +103,147 @@ class BandoriViewer(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.bapi = bandori_api()
-        self.bapi2 = bandori_api(party=False)
+        self.repo = bot.repository
         self.db = {}
-        self.loop_state = False
-        self.queue = {}
+        self.players = {}
+        self.downloads = DownloadManager(self.DB_PATH + 'downloads/')
+        self.audio_cache = AudioCache(self.DB_PATH + 'audio/', BandoriViewer.AUDIO_CACHE_MB * 1024 * 1024, bot.http_client)
+        self.rebuilding = False
 
         ########## Load db
 
-        database_exists = os.path.isfile(self.DB_PATH + 'database.pickle')
+        self.store = CollectionStore(self.DB_PATH + 'db/')
+        legacy = self.DB_PATH + 'database.pickle'
 
-        if not database_exists:
+        if not self.store.names() and os.path.isfile(legacy):
+            self.store.migrate(legacy)
+
+        if not self.store.names():
             logging.critical('There was no database file found. Commands may not work properly.\
 Run rebuild to create it as soon as possible.')
 
-        else:
-            logging.info(f'Loading database from {self.DB_PATH}')
-
-            with open(self.DB_PATH + 'database.pickle', 'rb') as handle:
-                self.db = pickle.load(handle)
-        
-        
-        ########## Argparse
-
-        self.parser = ArgumentParser(description='Bandori arg parser')
-
-        self.parser.add_argument('--id', type=int, help='id for bandori object')
-
-
-        ###############################################################################
-        # Card filter arguments
-        self.parser.add_argument('--trained', action='store_true', help='show a trained card or not')
-
-        self.parser.add_argument('--rarity', type=int, help='rarity of card')
+        # collections are only unpickled when first used, the catalog needs
+        # cards, members and songs. The big ones (assets, costumes) stay on disk.
+        self.db = LazyDatabase(self.store, transform=self.compact_collection)
+        self.catalog = Catalog(self.db)
+        # current event/gachas, cached until the next start or end date.
+        self.live = LiveInfo(self.repo, lambda: (self.db, self.catalog))
+
+        # looked up through self, a rebuild swaps the catalog and its caches.
+        bot.metrics.track_cache('query', lambda: self.catalog.query_cache)
+        bot.metrics.track_cache('embed', lambda: self.catalog.embeds)
+        bot.metrics.track_cache('audio', lambda: self.audio_cache)
+        bot.metrics.track_cache('live', lambda: self.live)
+
+        self.bot.loop.create_task(self.warm_up())
+
+        if BandoriViewer.AUDIO_CACHE_PREWARM:
+            self.bot.loop.create_task(self.prewarm_audio())
+        
+        
+        ########## Query parsers, one per command, set up once.
+
+        self.parsers = {
+            'cards' : QueryParser('cards', [
+                Option('id', convert=integer),
+                Option('trained', flag=True),
+                Option('rarity', 'i_rarity', choice({r : r for r in BandoriViewer.rarity_colors}), multi=True, ranged=True),
+                Option('attr', 'i_attribute', choice({a : a for a in BandoriViewer.attributes}), multi=True),
+                Option('skilltype', 'i_skill_type', enum(BandoriViewer.skilltypes), multi=True),
+                Option('member', 'member', integer, multi=True),
+                # max stats (trained if possible) and release date, see utils.columns.
+                Option('perf', 'performance', integer, ranged=True),
+                Option('tech', 'technique', integer, ranged=True),
+                Option('visual', 'visual', integer, ranged=True),
+                Option('total', 'total', integer, ranged=True),
+                Option('release', 'release', day, ranged=True)
+            ], sorts=BandoriViewer.card_sorts),
+            'members' : QueryParser('members', [
+                Option('id', convert=integer),
+                Option('year', 'i_school_year', choice({y : y for y in BandoriViewer.school_years}))
+            ]),
+            'songs' : QueryParser('songs', [
+                Option('id', convert=integer),
+                Option('band', 'bandId', choice({**{id : id for id in BandoriViewer.bands},
+                                                 **{name : id for id, name in BandoriViewer.bands.items()}}))
+            ])
+        }
+
+
+    async def warm_up(self):
+        '''
+        Load the small collections commands use in the background,
+        so the first eventnow/gachanow doesn't unpickle on the event loop.
+        '''
+        try:
+            with self.bot.metrics.timer('task_seconds', task='warm_up'):
+                await self.repo.run(self.db.warm, BandoriViewer.WARM_COLLECTIONS, timeout=None)
+        except Exception:
+            logging.error('Could not load the database.', exc_info=True)
 
-        self.parser.add_argument('--attr', type=str, help='attribute of card')
+    async def prewarm_audio(self):
+        with self.bot.metrics.timer('task_seconds', task='audio_prewarm'):
+            await self.audio_cache.prewarm(BandoriViewer.AUDIO_CACHE_PREWARM)
 
-        self.parser.add_argument('--skilltype', type=int, help='skill type of card')
 
-        self.parser.add_argument('--member', type=int, help='member id for the card')
+    def compact_collection(self, name, collection):
+        '''
+        Swap pydori objects in a db saved by an older version for records,
+        and save them back so this only happens once.
+        '''
+        if is_compact(name, collection):
+            return collection
 
-        ###############################################################################
-        # Member filter arguments
+        logging.warning(f'Converting {name} to compact records.')
+        collection = compact(name, collection)
+        self.store.save(name, collection)
 
-        self.parser.add_argument('--year', type=str, help='School year of member')
+        return collection
 
-        ###############################################################################
-        # Song filter arguments
 
-        self.parser.add_argument('--band', type=int, help='Band that plays the song')
-    
+    def cog_unload(self):
+        for player in self.players.values():
+            player.close()
+        self.downloads.close()
+        self.audio_cache.close()
 
 
     ##### Helper functions for formatting embeds.
     
-    def react_check(self, message=None, author=None):
-        message = message.id
-        def check(reaction, user):
-            if user.bot:
-                return False
-            if reaction.message.id != message:
-                return False
-            if author != user:
-                return False
-            return True
+    async def send_and_wait_page_selector(self, ctx, emojis=['▶️', '◀️', '❌'], embed=discord.Embed(title='None'), filters ={}, func = None, page=0, db_name="", sort=None):
         
-        return check
+        message = await ctx.channel.send(embed=embed)
 
+        # filter once for the whole session, page flips only slice this.
+        results = self.catalog.query(db_name, filters, sort)
+        state = {'page' : page}
 
-    def filter(self, bandori, filters={}):
-        if not filter:
-            return True
-        
-        for key, value in filters.items():
-            if value is not None:
-                if bandori.data[key] != value:
-                    
-                    return False
+        async def flip(reaction, user, step):
+            self.bot.edits.remove_reaction(message, reaction.emoji, user)
 
-        return True
-    
+            state['page'], new_embed = func(results, page=state['page'] + step)
 
-    async def send_and_wait_page_selector(self, ctx, emojis=['▶️', '◀️', '❌'], embed=discord.Embed(title='None'), filters ={}, func = None, page=0, db_name=""):
-        
-        message = await ctx.channel.send(embed=embed)
-        check = self.react_check(message=message, author = ctx.author)
+            # quick clicks are merged into a single edit.
+            self.bot.edits.edit(message, embed=new_embed)
+
+        self.bot.reactions.open(message, ctx.author, {
+            emojis[0] : partial(flip, step=1),
+            emojis[1] : partial(flip, step=-1),
+            emojis[2] : None
+        }, timeout=20)
 
         await message.add_reaction(emoji='◀️')
         await message.add_reaction(emoji='▶️')
         await message.add_reaction(emoji='❌')
-
-        while True:
-            try:
-                reaction, user = await self.bot.wait_for('reaction_add', timeout=20, check=check)
-                
-                if str(reaction.emoji) == emojis[0]:
-                    
-                    await reaction.remove(user)
-                    
-                    page, new_embed = func(self.db[db_name], page=page+1, filters=filters)
-
-                    await message.edit(embed=new_embed)
-                elif str(reaction.emoji) == emojis[1]:
-                    
-                    
-                    await reaction.remove(user)
-                    
-                    page, new_embed = func(self.db[db_name], page=page-1, filters=filters)
-
-                    await message.edit(embed=new_embed)
-                elif str(reaction.emoji) == emojis[2]:
-                    break
-                
-            except Exception as e:
-                print('Timeout.')
-                print(e)
-                break
     
-    def page_logic(self, page, data, filters):
+    def page_logic(self, page, data):
+        '''
+        data is the already filtered list, see Catalog.query
+        '''
         if page < 0:
                 page = 0
-            
-            #print(len(data))
-
-        new_data = []
 
-        for obj in data:
-            if self.filter(obj, filters):
-                new_data.append(obj)
-        
-        #print(len(new_data))
+        new_data = data
         len_cards = len(new_data)
         card_page_amount = 10 # 10 cards per page, 0 - 9
 
@@ -244,150 +275,182 @@ Run rebuild to create it as soon as possible.')
         try:
             response = await self.bot.wait_for('message', timeout = 5.0, check = lambda message : message.author == ctx.author)
         except:
-            await ctx.channel.send('Timed out, nothing was changed.')
+            return await ctx.channel.send('Timed out, nothing was changed.')
         
         if response.content.lower() == 'y':
-            await ctx.channel.send('I\'m updating my database, please don\'t do anything while I save...')
-            logging.warning('The database has started updating.')
-
-            loop = asyncio.get_event_loop()
-            job_result = await loop.run_in_executor(executor=None, func=self.update_data)
-            
-            if job_result:
-                await ctx.channel.send('Ok! I\'m done updating.')
-                logging.warning(f'Successfully updated database at {BandoriViewer.DB_PATH}. Restart the cog!')
-                latest = datetime.now()
-            else:
-                logging.error('There was an error. The database did not update correctly.')
-    
-
-    def update_data(self):
-        try:
-            self.db['cards'] = self.bapi.get_cards()
-            print('Done cards')
-            self.db['members'] = self.bapi.get_members()
-            print('Done members')
-            self.db['events'] = self.bapi.get_events()
-            print('Done events')
-            self.db['costumes'] = self.bapi.get_costumes()
-            print('Done costumes')
-            self.db['items'] = self.bapi.get_items()
-            print('Done items')
-            self.db['areaitems'] = self.bapi.get_areaitems()
-            print('Done areaitems')
-            self.db['assets'] = self.bapi.get_assets()
-            print('Done assets')
-            self.db['songs'] = self.bapi2.get_songs()
-            print('Done songs')
-
-            with open(self.DB_PATH + 'database.pickle', 'wb') as handle:
-                pickle.dump(self.db, handle, protocol=4)
+            if self.rebuilding:
+                return await ctx.channel.send('A rebuild is already running.')
 
-            return True
+            self.rebuilding = True
+            await ctx.channel.send('I\'m updating my database, you can keep using me while I save...')
+            logging.warning('The database has started updating.')
 
-        except Exception as e:
-            logging.error('Error while updating.', exc_info=True)
-            return False
+            try:
+                with self.bot.metrics.timer('task_seconds', task='rebuild'):
+                    pipeline = RebuildPipeline(self.repo, self.db)
+                    collections = await pipeline.run()
+                    db = self.db.updated(collections)
+                    catalog = await self.repo.run(Catalog, db, timeout=None)
+                    await self.repo.run(self.store.save_all, pipeline.dirty(collections), timeout=None)
+            except Exception:
+                logging.error('There was an error. The database did not update correctly.', exc_info=True)
+                return await ctx.channel.send('Something went wrong, nothing was changed.')
+            finally:
+                self.rebuilding = False
+
+            # swap in one go, commands never see half a db.
+            self.db, self.catalog = db, catalog
+            self.live.invalidate()
+            self.bot.dispatch('database_rebuilt')
+            BandoriViewer.latest = datetime.now()
+
+            status = 'Ok! I\'m done updating.' if pipeline.ok else 'Done, but some collections failed and kept their old data.'
+            await ctx.channel.send(f'{status}\n```{pipeline.summary()}```')
+            logging.warning(f'Updated database at {BandoriViewer.DB_PATH}.\n{pipeline.summary()}')
     
 
     # card commands.
 
     @commands.command(name = 'card')
     async def card(self, ctx, *, message = None):
-        
-        if message is not None:
-            args = self.parser.parse_args(message.split(' '))
-
-            # Get arguments
-            #print(args.id)
-            id = args.id
-            trained = args.trained
-            rarity = args.rarity
-            attribute = args.attr
-            if attribute:
-                attribute = attribute[0].upper() + attribute[1:]
-            skilltype = BandoriViewer.skilltypes.get(args.skilltype)
-            memberid = args.member
-            
-
-            filters = {
-                    'i_rarity' : rarity,
-                    'i_attribute' : attribute,
-                    'i_skill_type' : skilltype,
-                    'member' : memberid
-                }
-            
-            # if an id arg exists, get the card.
-            if id:
-                for card in self.db["cards"]:
-                    if card.id == id:
-                        await ctx.channel.trigger_typing()
-                        await self.card_switcher(ctx, embed=self.format_card(card.data, trained), trained=trained, card=card)
-                        return
-            
+        try:
+            query = self.parsers['cards'].parse(message)
+        except QueryError as e:
+            return await ctx.channel.send(str(e))
+
+        # if an id arg exists, get the card.
+        if query.id is not None:
+            card = self.catalog.get('cards', query.id)
+            if card is None:
+                return await ctx.channel.send('No card with that id.')
+
+            await ctx.channel.trigger_typing()
+            member_name = await self.member_name(card.member)
+            await self.card_switcher(ctx, embed=self.cached_embed('cards', card, query.trained, member_name), trained=query.trained, card=card, member_name=member_name)
+            return
 
-            # otherwise we filter.
-            elif sum([0 if _ is None else 1 for _ in list(filters.values())]) != 0:
-                await ctx.channel.trigger_typing()
-                page, embed = self.format_all_cards_embed(self.db["cards"], page=0, filters=filters)
-                await self.send_and_wait_page_selector(ctx, embed=embed, filters=filters, func=self.format_all_cards_embed, db_name='cards')
+        # otherwise we filter.
+        results = self.catalog.query('cards', query.filters, query.sort)
+        if not results:
+            return await ctx.channel.send('Nothing matched those arguments.')
 
-            else:
-                await ctx.channel.send('Nothing matched those arguments.')
-        
-        else:
-            
-            page, embed = self.format_all_cards_embed(self.db["cards"], page=0)
-            await self.send_and_wait_page_selector(ctx, embed=embed, func=self.format_all_cards_embed, db_name='cards')
+        page, embed = self.format_all_cards_embed(results, page=0)
+        await self.send_and_wait_page_selector(ctx, embed=embed, filters=query.filters, func=self.format_all_cards_embed, page=page, db_name='cards', sort=query.sort)
 
 
     @commands.command(name = 'cardname')
     async def cardname(self, ctx, *, message =None):
-        for card in self.db["cards"]:
-            if card.name is not None:
-                if card.name.lower() == message.lower():
-                    await ctx.channel.trigger_typing()
-                    await self.card_switcher(ctx, embed=self.format_card(card.data), card=card)
-                    return
+        card, candidates = self.lookup('cards', message)
+        if card is not None:
+            await ctx.channel.trigger_typing()
+            member_name = await self.member_name(card.member)
+            await self.card_switcher(ctx, embed=self.cached_embed('cards', card, member_name=member_name), card=card, member_name=member_name)
+            return
         
-        await ctx.channel.send('Did not find a card with that name.')
+        await ctx.channel.send(self.did_you_mean('card', candidates))
     
 
 
-    async def card_switcher(self, ctx, emojis=['🔄', '❌'], embed=discord.Embed(title='None'), trained=False, card=None):
-        m = await ctx.channel.send(embed=embed)
-        check = self.react_check(message=m, author = ctx.author)
+    def lookup(self, kind, name):
+        '''
+        (object, []) when name matches exactly or only matches one object,
+        otherwise (None, the closest names) for a did you mean.
+        '''
+        obj = self.catalog.find(kind, name)
+        if obj is not None:
+            return obj, []
 
-        await m.add_reaction(emoji='🔄')
-        await m.add_reaction(emoji='❌')
+        found = self.catalog.search[kind].search(name, k=BandoriViewer.SEARCH_RESULTS)
+        if len(found) == 1:
+            return found[0], []
+        return None, found
 
-        while True:
-            try:
-                reaction, user = await self.bot.wait_for('reaction_add', timeout=10, check=check)
 
-                if str(reaction.emoji) == emojis[0]:
-                    await reaction.remove(user)
+    def did_you_mean(self, what, candidates, name_attr='name'):
+        text = f'Did not find a {what} with that name.'
+        if candidates:
+            text += ' Did you mean:\n' + '\n'.join(f'`{getattr(c, name_attr)}` (id: {c.id})' for c in candidates)
+        return text
+
+
+    async def card_switcher(self, ctx, emojis=['🔄', '❌'], embed=discord.Embed(title='None'), trained=False, card=None, member_name=None):
+        m = await ctx.channel.send(embed=embed)
+        state = {'trained' : trained}
+
+        async def switch(reaction, user):
+            self.bot.edits.remove_reaction(m, reaction.emoji, user)
+
+            state['trained'] = not state['trained']
 
-                    trained = not trained
+            new_embed = self.cached_embed('cards', card, state['trained'], member_name)
+            self.bot.edits.edit(m, embed=new_embed)
 
-                    new_embed = self.format_card(card.data, trained)
-                    await m.edit(embed=new_embed)
+        self.bot.reactions.open(m, ctx.author, {emojis[0] : switch, emojis[1] : None}, timeout=10)
 
-                    
-                elif str(reaction.emoji) == emojis[2]:
-                    break
-            except:
-                print('Timeout.')
-                break
+        await m.add_reaction(emoji='🔄')
+        await m.add_reaction(emoji='❌')
 
     
 
-    def format_card(self, data, trained = False):
+    async def member_name(self, id):
+        '''
+        Name (and band) of a member, from the local db.
+        Only asks the api when the member is missing locally, and remembers the answer.
+        '''
+        catalog = self.catalog
+
+        if id not in catalog.member_names:
+            try:
+                member = (await self.repo.get_members(id=[id]))[0]
+            except Exception:
+                logging.warning(f'Could not get the name of member {id}', exc_info=True)
+                return None
+
+            catalog.member_names[id] = member.name
+            catalog.member_bands[id] = member.band
+
+        name = catalog.member_names[id]
+        band = catalog.member_bands.get(id)
+
+        return f'{name} ({band})' if band else name
+
+
+    def cached_embed(self, kind, obj, trained = False, member_name = None):
+        '''
+        Embed of a card, member or song, rendered once and then served from
+        the catalog's embed cache. Both versions of a card are rendered together
+        so the trained toggle never renders. A rebuild makes a new catalog,
+        which throws the old embeds away.
+        '''
+        embeds = self.catalog.embeds
+        key = (kind, obj.id, trained)
+        embed = embeds.get(key)
+        if embed is not None:
+            return embed
+
+        if kind == 'cards':
+            untrained = self.format_card(obj.data, False, member_name)
+            # only 3* and up have a trained art.
+            both = (untrained, self.format_card(obj.data, True, member_name) if obj.i_rarity > 2 else untrained)
+            embed = both[trained]
+
+            # don't keep an embed missing the member name, the api might answer next time.
+            if member_name is not None:
+                embeds.put((kind, obj.id, False), both[0])
+                embeds.put((kind, obj.id, True), both[1])
+            return embed
+
+        embed = self.format_member(obj.data) if kind == 'members' else self.format_song(obj)
+        embeds.put(key, embed)
+        return embed
+
+
+    def format_card(self, data, trained = False, member_name = None):
         name = ''
         japanese_name = ''
         skill_name = ''
         japanese_skill_name = ''
-        rarity = ''.join([':star:' for _ in range(data["i_rarity"])])
+        rarity = ':star:' * data["i_rarity"]
 
         if data["name"] is not None:
             name = data["name"]
@@ -410,7 +473,7 @@ Run rebuild to create it as soon as possible.')
         
         embed.add_field(name = 'Rarity', value=rarity)
         embed.add_field(name = 'Attribute', value=data["i_attribute"])
-        embed.add_field(name = 'Info', value=f'Id: {data["id"]}\nMember: [{data["member"]}] {self.bapi.get_members(id=[data["member"]])[0].name}', inline=False)
+        embed.add_field(name = 'Info', value=f'Id: {data["id"]}\nMember: [{data["member"]}] {member_name}', inline=False)
         embed.add_field(name = 'Stats ([min] - [max])', value=f'```PERF: {data["performance_min"]}\t\t{data["performance_max"]}\nTECH: {data["technique_min"]}\t\t{data["technique_max"]}\nVISL: {data["visual_min"]}\t\t{data["visual_max"]}```',
         inline=False)
         
@@ -424,8 +487,8 @@ Run rebuild to create it as soon as possible.')
         return embed
 
 
-    def format_all_cards_embed(self, data, page = 0, filters={}):
-        page, total_pages, new_data, start, end = self.page_logic(data=data, page=page, filters=filters)
+    def format_all_cards_embed(self, data, page = 0):
+        page, total_pages, new_data, start, end = self.page_logic(data=data, page=page)
 
         cards_page = [card for card in new_data[ start : end ]]
 
@@ -434,7 +497,7 @@ Run rebuild to create it as soon as possible.')
         for c in cards_page:
             name = ''
             japanese_name = ''
-            rarity = ''.join([':star:' for _ in range(c.rarity)])
+            rarity = ':star:' * c.i_rarity
 
             if c.name is not None:
                 name = c.name
@@ -453,48 +516,37 @@ Run rebuild to create it as soon as possible.')
     
     @commands.command(name='member')
     async def member(self, ctx, *, message=None):
-        if message is not None:
-            args = self.parser.parse_args(message.split(' '))
-
-            # Get arguments
-            #print(args.id)
-            id = args.id
-            year = args.year
-            if year:
-                year = year[0].upper() + year[1:]
-
-
-            filters = {
-                'i_school_year' : year
-            }
-            # if an id arg exists, get the card.
-            if id:
-                for member in self.db["members"]:
-                    if member.id == id:
-                        await ctx.channel.trigger_typing()
-                        embed = self.format_member(member.data)
-                        await ctx.channel.send(embed=embed)
-                        return
-            
-            elif sum([0 if _ is None else 1 for _ in list(filters.values())]) != 0:
-                page, embed = self.format_all_members_embed(self.db["members"], page=0, filters=filters)
-                await self.send_and_wait_page_selector(ctx, embed=embed, func=self.format_all_members_embed, page=page, db_name='members')
-            else:
-                await ctx.channel.send('Nothing matched those arguments.')
-        
-        else:
-            page, embed = self.format_all_members_embed(self.db["members"], page=0)
-            await self.send_and_wait_page_selector(ctx, embed=embed, func=self.format_all_members_embed, page=page, db_name='members')
+        try:
+            query = self.parsers['members'].parse(message)
+        except QueryError as e:
+            return await ctx.channel.send(str(e))
+
+        # if an id arg exists, get the member.
+        if query.id is not None:
+            member = self.catalog.get('members', query.id)
+            if member is None:
+                return await ctx.channel.send('No member with that id.')
+
+            await ctx.channel.trigger_typing()
+            await ctx.channel.send(embed=self.cached_embed('members', member))
+            return
+
+        # otherwise we filter.
+        results = self.catalog.query('members', query.filters)
+        if not results:
+            return await ctx.channel.send('Nothing matched those arguments.')
+
+        page, embed = self.format_all_members_embed(results, page=0)
+        await self.send_and_wait_page_selector(ctx, embed=embed, filters=query.filters, func=self.format_all_members_embed, page=page, db_name='members')
     
     @commands.command(name = 'membername')
     async def membername(self, ctx, *, message =None):
-        for member in self.db["members"]:
-            if member.name is not None:
-                if member.name.lower() == message.lower():
-                    await ctx.channel.send(embed=self.format_member(member.data))
-                    return
+        member, candidates = self.lookup('members', message)
+        if member is not None:
+            await ctx.channel.send(embed=self.cached_embed('members', member))
+            return
         
-        await ctx.channel.send('Did not find a card with that name.')
+        await ctx.channel.send(self.did_you_mean('member', candidates))
 
 
 
@@ -529,8 +581,8 @@ Run rebuild to create it as soon as possible.')
         return embed
     
 
-    def format_all_members_embed(self, data, page = 0, filters={}):
-        page, total_pages, new_data, start, end = self.page_logic(data=data, page=page, filters=filters)
+    def format_all_members_embed(self, data, page = 0):
+        page, total_pages, new_data, start, end = self.page_logic(data=data, page=page)
 
         
 
@@ -550,50 +602,38 @@ Run rebuild to create it as soon as possible.')
 
     @commands.command(name='song')
     async def song(self, ctx, *, message=None):
-        if message is not None:
-            args = self.parser.parse_args(message.split(' '))
-
-            # Get arguments
-            #print(args.id)
-            id = args.id
-            band = args.band
-            
-            filters = {
-                'bandId' : band
-            }
-
-            # if an id arg exists, get the card.
-            if id:
-                for song in self.db["songs"]:
-                    if song.id == id:
-                        await ctx.channel.trigger_typing()
-                        embed = self.format_song(song)
-                        await ctx.channel.send(embed=embed)
-
-                        return
+        try:
+            query = self.parsers['songs'].parse(message)
+        except QueryError as e:
+            return await ctx.channel.send(str(e))
+
+        # if an id arg exists, get the song.
+        if query.id is not None:
+            song = self.catalog.get('songs', query.id)
+            if song is None:
+                return await ctx.channel.send('No song with that id.')
+
+            await ctx.channel.trigger_typing()
+            await ctx.channel.send(embed=self.cached_embed('songs', song))
+            return
 
-            elif sum([0 if _ is None else 1 for _ in list(filters.values())]) != 0:
-                await ctx.channel.trigger_typing()
-                page, embed = self.format_all_songs_embed(self.db["songs"], page=0, filters=filters)
-                await self.send_and_wait_page_selector(ctx, embed=embed, filters=filters, func=self.format_all_songs_embed, db_name='songs')
+        # otherwise we filter.
+        results = self.catalog.query('songs', query.filters)
+        if not results:
+            return await ctx.channel.send('Nothing matched those arguments.')
 
-            else:
-                await ctx.channel.send('Nothing matched those arguments.')
-        
-        else:
-            page, embed = self.format_all_songs_embed(self.db["songs"], page=0)
-            await self.send_and_wait_page_selector(ctx, embed=embed, func=self.format_all_songs_embed, page=page, db_name='songs')
+        page, embed = self.format_all_songs_embed(results, page=0)
+        await self.send_and_wait_page_selector(ctx, embed=embed, filters=query.filters, func=self.format_all_songs_embed, page=page, db_name='songs')
     
     @commands.command(name = 'songname')
     async def songname(self, ctx, *, message =None):
-        for song in self.db["songs"]:
-            if song.title is not None:
-                if song.title.lower() == message.lower():
-                    await ctx.channel.send(embed=self.format_song(song))
+        song, candidates = self.lookup('songs', message)
+        if song is not None:
+            await ctx.channel.send(embed=self.cached_embed('songs', song))
 
-                    return
+            return
         
-        await ctx.channel.send('Did not find a song with that name.')
+        await ctx.channel.send(self.did_you_mean('song', candidates, name_attr='title'))
     
 
     @commands.command(name = 'join')
@@ -608,6 +648,8 @@ Run rebuild to create it as soon as possible.')
                 voice = await channel.connect()
 
             print('Bot connected to', channel)
+            if ctx.guild.id in self.players:
+                self.players[ctx.guild.id].connected()
             return True
         except Exception as e:
             print(e)
@@ -620,7 +662,9 @@ Run rebuild to create it as soon as possible.')
         voice = get(self.bot.voice_clients, guild = ctx.guild)
 
         if voice and voice.is_connected():
-            self.loop_state = False
+            player = self.players.pop(ctx.guild.id, None)
+            if player:
+                player.close()
             await voice.disconnect()
             print('Bot disconnected from', channel)
         else:
@@ -650,13 +694,8 @@ Run rebuild to create it as soon as possible.')
     
     @commands.command(name = 'stop', help = 'stops the song', aliases = ['s'])
     async def stop(self, ctx):
-        voice = get(self.bot.voice_clients, guild = ctx.guild)
-
-        self.loop_state = False
-
-        if voice and (voice.is_playing() or voice.is_paused()):
+        if self.player(ctx.guild).stop():
             print('Stopping audio')
-            voice.stop()
             await ctx.send('Stopped audio')
         else:
             print('Music not playing')
@@ -664,24 +703,29 @@ Run rebuild to create it as soon as possible.')
 
     @commands.command(name = 'loop', aliases = ['l'])
     async def loop(self, ctx):
-        if self.loop_state:
-            self.loop_state = False
+        player = self.player(ctx.guild)
+
+        if player.loop_state:
+            player.loop_state = False
             await ctx.send('Turned loop off!')
         else:
-            self.loop_state = True
+            player.loop_state = True
             await ctx.send('Turned loop on!')
 
 
     @commands.command(name = 'play')
     async def playsong(self, ctx, *, id = None):
         link = ''
+        title = None
         youtube = False
 
         if id is not None and id.isdigit():
-            for song in self.db["songs"]:
-                if song.id == int(id):
-                    link = song.bgm
-                    await ctx.channel.trigger_typing()
+            song = self.catalog.get('songs', int(id))
+            if song is None:
+                return await ctx.send('No song with that id.')
+
+            link, title = song.bgm, song.title
+            await ctx.channel.trigger_typing()
         
         elif id is not None:
             link = id 
@@ -697,161 +741,94 @@ Run rebuild to create it as soon as possible.')
 
         if not await self.join(ctx):
             return
-        
-        def check_queue():
-            if not self.loop_state:
-                queue_in_file = os.path.isdir('./queue')
-                if queue_in_file:
-                    dir = os.path.abspath(os.path.realpath('queue'))
-                    length_queue = len(os.listdir(dir))
-                    still_a_queue = length_queue - 1
-
-                    try:
-                        first_file = os.listdir(dir)[0]
-                    except:
-                        print('No more songs in the queue')
-                        self.queue.clear()
-                        return
-
-                    main_location = os.path.dirname(os.path.realpath('bandori-cord'))
-                    song_path = os.path.abspath(os.path.realpath('queue') + '/' + first_file)
-
-                    if length_queue != 0:
-                        print('song done, playing next in queue')
-                        print('songs still in queue', still_a_queue)
-                        song_in_there = os.path.isfile('song.mp3')
-                        if song_in_there:
-                            os.remove('song.mp3')
-                        shutil.move(song_path, main_location)
-
-                        for file in os.listdir('./'):
-                            if file.endswith('.mp3'):
-                                os.rename(file, 'song.mp3')
-
-                        voice.play(discord.FFmpegPCMAudio('song.mp3'), after = lambda e: check_queue())
-                        voice.source = discord.PCMVolumeTransformer(voice.source)
-                        voice.source.volume = 1.0
-
-                    else:
-                        self.queue.clear()
-                        return
-
-                else:
-                    self.queue.clear()
-                    print('No songs queued before the ending of the last song')
-                    return
-            else:
-                voice.play(discord.FFmpegPCMAudio('song.mp3'), after = lambda e: check_queue())
-                voice.source = discord.PCMVolumeTransformer(voice.source)
-                voice.source.volume = 1.0
-        
 
+        player = self.player(ctx.guild)
 
-        check_song = os.path.isfile('song.mp3')
-        try:
-            if check_song:
-                os.remove('song.mp3')
-                self.queue.clear()
-                print('Removed old song file')
-        except PermissionError:
-            print('Trying to delete old song file failed because it\'s being used')
+        if player.is_playing:
             await ctx.send('Music is already playing. Stop the current song, or queue your song.')
             return
 
+        player.clear()
 
-        queue_in_file = os.path.isdir('./queue')
-        try:
-            queue_folder = './queue'
-            if queue_in_file:
-                print('Removed old queue folder')
-                shutil.rmtree(queue_folder)
-        except:
-            print('No old queue folder')
+        player.add(self.make_track(ctx, link, youtube, title))
 
-        if not youtube:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(link) as resp:
-                    if resp.status != 200:
-                        return await ctx.channel.send('Could not download file...')
-                    data = io.BytesIO(await resp.read())
-            
-            with open(f'song.mp3', 'wb') as outf:
-                outf.write(data.getbuffer())
+        #await ctx.channel.send(f'Now playing: [{song.title} - {song.band_name}]')
+        return
 
-        else:
-            loop = asyncio.get_event_loop()
-            job_result = await loop.run_in_executor(None, self.youtube_download, link)
 
-            if job_result:
-                print('Downloaded song')
+    @commands.command(name = 'queue', aliases = ['q'])
+    async def queue(self, ctx, *, id):
+        player = self.player(ctx.guild)
 
-        voice = get(self.bot.voice_clients, guild = ctx.guild)
+        if id is not None and id.isdigit():
+            song = self.catalog.get('songs', int(id))
+            if song is None:
+                return await ctx.send('No song with that id.')
 
+            track = self.make_track(ctx, song.bgm, False, song.title)
+        
+        else:
+            track = self.make_track(ctx, id, True)
 
-        voice.play(discord.FFmpegPCMAudio(f'song.mp3'), after = lambda e: check_queue())
-        voice.source = discord.PCMVolumeTransformer(voice.source)
-        voice.source.volume = 1.0
+        player.add(track)
 
-        #await ctx.channel.send(f'Now playing: [{song.title} - {song.band_name}]')
-        return
-    
-        
+        voice = player.voice
+        if not voice or not voice.is_connected():
+            return await ctx.send('Added to queue. I\'m not in a voice channel, use ;join to start playing.')
+        await ctx.send(f'Added to queue')
 
-        
-    
 
-    @commands.command(name = 'queue', aliases = ['q'])
-    async def queue(self, ctx, *, id):
+    def player(self, guild):
+        '''
+        The music player of a guild, made on first use.
+        '''
+        if guild.id not in self.players:
+            self.players[guild.id] = GuildPlayer(self.bot, guild)
 
-        queue_in_file = os.path.isdir('./queue')
+        return self.players[guild.id]
 
-        if not queue_in_file:
-            os.mkdir('queue')
-        dir = os.path.abspath(os.path.realpath('queue'))
 
-        queue_number = len(os.listdir(dir))
-        queue_number += 1
+    def make_track(self, ctx, link, youtube, title=None):
+        '''
+        Track for a bandori bgm or youtube url, streamed or downloaded
+        depending on STREAM_AUDIO. The player gets it ready when its turn is near.
+        '''
+        if not youtube:
+            self.audio_cache.record_play(link)
+            return BgmTrack(title or link, self.audio_cache, link, BandoriViewer.STREAM_AUDIO, ctx.channel)
 
-        while True:
-            if queue_number in list(self.queue.keys()):
-                queue_number += 1
-            else:
-                self.queue[queue_number] = queue_number
-                break
+        if not BandoriViewer.STREAM_AUDIO:
+            return DownloadTrack(title or link, self.downloads, link, ctx.channel,
+                                 reporter=lambda job: self.report_progress(ctx, job))
 
-        queue_path = os.path.abspath(os.path.realpath('queue') + f'/song{queue_number}.mp3')
+        return YoutubeTrack(title or link, self.downloads, link, ctx.channel)
 
-        if id is not None and id.isdigit():
-            for song in self.db["songs"]:
-                if song.id == int(id):
-                    await ctx.channel.trigger_typing()
-
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(song.bgm) as resp:
-                            if resp.status != 200:
-                                return await ctx.channel.send('Could not download file...')
-                            data = io.BytesIO(await resp.read())
-                    
-                    with open(f'{queue_path}', 'wb') as outf:
-                        outf.write(data.getbuffer())
-        
-        elif id is not None:
-            loop = asyncio.get_event_loop()
-            job_result = await loop.run_in_executor(None, self.youtube_download, id, queue_path, True)
 
-            if job_result:
-                print('Downloaded song')
+    async def report_progress(self, ctx, job):
+        '''
+        Keep a message in the channel up to date with a download's progress.
+        Edits go through bot.edits, so a late progress update is merged into the final one.
+        '''
+        message = await ctx.channel.send(f'Downloading {job.url}...')
 
-        
-        await ctx.send(f'Added to queue')
+        while not job.done:
+            await asyncio.wait({job.future}, timeout=BandoriViewer.PROGRESS_INTERVAL)
+            if not job.done:
+                self.bot.edits.edit(message, content=f'Downloading {job.title}... {job.progress:.0%}')
+
+        if job.future.cancelled() or job.cancelled:
+            self.bot.edits.edit(message, content=f'Cancelled download of {job.title}.')
+        elif job.future.exception() is not None:
+            logging.error(f'Could not download {job.url}', exc_info=job.future.exception())
+            self.bot.edits.edit(message, content='Could not download file...')
+        else:
+            print('Downloaded song')
+            self.bot.edits.edit(message, content=f'Downloaded {job.title}.')
 
     @commands.command(name = 'skip', aliases = ['next'])
     async def skip(self, ctx):
-        voice = get(self.bot.voice_clients, guild = ctx.guild)
-
-        if voice and voice.is_playing():
+        if self.player(ctx.guild).skip():
             print('Stopping audio')
-            voice.stop()
             await ctx.send('Skipped audio')
         else:
             print('Music not playing')
@@ -863,10 +840,10 @@ Run rebuild to create it as soon as possible.')
         embed.set_image(url=song.jacket)
         embed.set_thumbnail(url=song.thumb)
         
-        embed.add_field(name = 'Band', value=f'[{song.band}] {song.band_name}', inline=False)
+        embed.add_field(name = 'Band', value=f'[{song.bandId}] {song.band_name}', inline=False)
         embed.add_field(name = 'Lyricist', value=song.lyricist)
         embed.add_field(name = 'Composer', value=song.composer)
-        embed.add_field(name = 'Arranger', value=song.data["arranger"])
+        embed.add_field(name = 'Arranger', value=song.arranger)
         embed.add_field(name = 'How to get', value=song.how_to_get, inline=False)
 
         embed.add_field(name = 'Difficulty', value=f'{song.difficulty}\n\
@@ -880,8 +857,8 @@ Run rebuild to create it as soon as possible.')
         return embed
     
 
-    def format_all_songs_embed(self, data, page=0, filters={}):
-        page, total_pages, new_data, start, end = self.page_logic(data=data, page=page, filters=filters)
+    def format_all_songs_embed(self, data, page=0):
+        page, total_pages, new_data, start, end = self.page_logic(data=data, page=page)
 
         songs_page = [song for song in new_data[start:end]]
 
@@ -895,48 +872,24 @@ Run rebuild to create it as soon as possible.')
         return page, embed
     
 
-    def youtube_download(self, url, path=None, queue=False):
-        if path:
-            ydl_opts = {'format': 'bestaudio/best', 'default_search': 'ytsearch', 'outtmpl': path,\
-            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}]}
-        else:
-            ydl_opts = {'format': 'bestaudio/best', 'default_search': 'ytsearch',\
-            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}]}
-
-        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-            print('Downloading audio')
-
-            ydl.download([url])
-        
-        if not queue:
-            for file in os.listdir('./'):
-                #print(file)
-                if file.endswith('.mp3'):
-                    name = file
-                    print('Renamed file:', file)
-
-                    os.rename(file, 'song.mp3')
-    
-
-
-
-
-
     ####### event command.
     @commands.command(name='eventnow')
     async def current_event(self, ctx):
-        current = self.bapi.get_current_event()
+        try:
+            current = await self.live.current_event()
+        except Exception:
+            logging.warning('Could not get the current event.', exc_info=True)
+            return await ctx.channel.send('Could not reach the bandori api, try again later.')
     
         if current:
-            await ctx.channel.send(embed=self.format_event(current))
+            await ctx.channel.send(embed=self.format_event(*current))
 
 
 
-    def format_event(self, event):
+    def format_event(self, event, main, boost_members):
         embed = discord.Embed(title = 'Current ongoing event:\n' + event.name)
 
-        main = event.get_main_card()
-        boostm = [m.name for m in event.get_boost_members()]
+        boostm = [m.name for m in boost_members]
         start = event.get_start_date().strftime("%m/%d/%Y")
         end = event.get_end_date().strftime("%m/%d/%Y")
         
@@ -959,7 +912,11 @@ Run rebuild to create it as soon as possible.')
     ###### gacha command
     @commands.command(name='gachanow')
     async def current_gachas(self, ctx):
-        current = self.bapi2.get_active_gachas()
+        try:
+            current = await self.live.active_gachas()
+        except Exception:
+            logging.warning('Could not get the active gachas.', exc_info=True)
+            return await ctx.channel.send('Could not reach the bandori api, try again later.')
         
         if current:
             gachas = [(e.name, e.id, e) for e in current]
@@ -977,7 +934,7 @@ Run rebuild to create it as soon as possible.')
 
     @commands.command(name='latestupdate')
     async def get_latest(self, ctx):
-        await ctx.channel.send(latest)
+        await ctx.channel.send(self.latest)
     
 
 
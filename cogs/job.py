@@ -1,68 +1,225 @@
-from discord.ext import tasks, commands
-from pydori import bandori_api
+from discord.ext import commands
+from datetime import datetime, timedelta
 import asyncio
+import hashlib
+import heapq
+import json
 import discord
+import logging
+import os
+from utils.catalog import Catalog
+from utils.live import LiveInfo
+from utils.board import BoardConfig, BoardMessage
 
 class BandoriTasks(commands.Cog):
     '''
-    Manage automatic tasks that runs on an interval
+    Manage automatic tasks
+
+    The info board (active gachas and the current event) is kept up to
+    date in every channel added with ;board add. It is updated when an
+    event or gacha starts or ends: the start and end dates in the db go on
+    a heap and the board sleeps until the earliest one. The embeds are
+    built once per update, the channels are edited concurrently, and a
+    message whose embed didn't change isn't edited at all.
     '''
-    UPDATE_CHANNEL_ID = 748253854688083988 # put your channel id here.
-    MESSAGE_IDS = {}
+    BOARD_PATH = 'data/infoboard.json'
+    # channel the board starts in when there is no board config yet.
+    UPDATE_CHANNEL_ID = os.getenv('INFO_BOARD_CHANNEL')
+    # channels updated at the same time, bot.edits keeps each channel under its rate limit.
+    BOARD_CONCURRENCY = 5
+    # longest sleep between two updates, when nothing starts or ends before that.
+    MAX_SLEEP = timedelta(hours=24)
+    # wake up a bit after a boundary, so it's really over.
+    SLACK = timedelta(seconds=5)
 
     def __init__(self, bot):
         self.bot = bot
-        self.bapi = bandori_api()
-        self.bapi2 = bandori_api(party=False)
+        self.repo = bot.repository
+        # only used when the BandoriViewer cog isn't loaded, straight from the api.
+        self.fallback = LiveInfo(self.repo, lambda: ({}, Catalog({})))
 
-        self.info_update.start()
+        self.board = BoardConfig(BandoriTasks.BOARD_PATH)
+        if not os.path.isfile(BandoriTasks.BOARD_PATH) and BandoriTasks.UPDATE_CHANNEL_ID:
+            self.board.add(int(BandoriTasks.UPDATE_CHANNEL_ID))
+
+        self.boundaries = []    # heap of upcoming start/end dates
+        self.published = {}     # (channel id, board key) : hash of the embed it shows
+        self.wake = asyncio.Event()
+        self.task = bot.loop.create_task(self.info_update())
+
+    def cog_unload(self):
+        self.task.cancel()
+
+    @commands.Cog.listener()
+    async def on_database_rebuilt(self):
+        # new events or gachas, plan again.
+        self.boundaries = []
+        self.wake.set()
 
-    @tasks.loop(hours=24)
     async def info_update(self):
-        await asyncio.sleep(5)
-        channel = self.bot.get_channel(BandoriTasks.UPDATE_CHANNEL_ID)
-
-        tasks = [ self.active_gachas,
-                  self.active_events
-                  ]
-        
-        for task in tasks:
-            await task(channel)
-        
+        await self.bot.wait_until_ready()
+
+        while True:
+            try:
+                with self.bot.metrics.timer('task_seconds', task='info_update'):
+                    await self.update_board()
+            except Exception:
+                logging.error('Could not update the info board.', exc_info=True)
+
+            delay = self.next_update() - datetime.utcnow()
+            print(f'Next info board update in {delay}.')
+
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=max(delay.total_seconds(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def next_update(self):
+        '''
+        When the board needs to change next: the earliest upcoming start or
+        end date of an event or gacha, or MAX_SLEEP from now.
+        '''
+        now = datetime.utcnow()
+
+        if not self.boundaries:
+            self.boundaries = [d for d in set(self.live.boundaries()) if d > now]
+            heapq.heapify(self.boundaries)
+
+        while self.boundaries and self.boundaries[0] <= now:
+            heapq.heappop(self.boundaries)
+
+        if not self.boundaries:
+            return now + BandoriTasks.MAX_SLEEP
+        return min(self.boundaries[0] + BandoriTasks.SLACK, now + BandoriTasks.MAX_SLEEP)
+
+    @staticmethod
+    def embed_hash(embed):
+        return hashlib.sha1(json.dumps(embed.to_dict(), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    async def update_board(self, channels=None):
+        '''
+        Build the board embeds once and post them to every board channel (or just channels).
+        '''
+        embeds = {}     # key : (embed, hash)
+        for key, build in (('g', self.active_gachas), ('e', self.active_events)):
+            try:
+                embed = await build()
+            except asyncio.TimeoutError:
+                logging.warning(f'Timed out while running {build.__name__}, skipping it.')
+                continue
+            if embed is not None:
+                embeds[key] = (embed, BandoriTasks.embed_hash(embed))
+
+        limit = asyncio.Semaphore(BandoriTasks.BOARD_CONCURRENCY)
+
+        async def publish(channel_id):
+            async with limit:
+                for key, (embed, h) in embeds.items():
+                    if self.published.get((channel_id, key)) == h:
+                        continue
+                    if await self.publish(channel_id, key, embed):
+                        self.published[(channel_id, key)] = h
+
+        await asyncio.gather(*[publish(channel_id) for channel_id in channels or list(self.board.channels)])
         print('Updated info board.')
-    
 
-    async def active_gachas(self, channel):
-        current = self.bapi2.get_active_gachas()
-        
+    async def publish(self, channel_id, key, embed):
+        '''
+        Edit the board message in place, or post a new one if it's not there (anymore).
+        Returns whether the channel shows the embed now.
+        '''
+        message_id = self.board.message(channel_id, key)
+        if message_id is not None:
+            sent = await self.bot.edits.edit(BoardMessage(self.bot, channel_id, message_id), embed=embed)
+            if sent is not None:
+                # on any other error keep the message, the next update tries again.
+                return sent
+
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            logging.warning(f'Info board channel {channel_id} is gone, remove it with ;board remove.')
+            return False
+
+        try:
+            m = await channel.send(embed=embed)
+        except discord.HTTPException:
+            logging.warning(f'Could not post the info board in {channel_id}', exc_info=True)
+            return False
+        self.board.set_message(channel_id, key, m.id)
+        return True
+
+
+    @commands.group(name='board', invoke_without_command=True)
+    async def board_command(self, ctx):
+        channels = [f'<#{channel_id}>' for channel_id in self.board.channels]
+        await ctx.channel.send('Info board channels: ' + (', '.join(channels) or 'none'))
+
+    @board_command.command(name='add')
+    @commands.has_permissions(administrator=True)
+    async def board_add(self, ctx, channel: discord.TextChannel = None):
+        channel = channel or ctx.channel
+        if not self.board.add(channel.id):
+            return await ctx.channel.send(f'{channel.mention} already has the info board.')
+
+        await ctx.channel.send(f'Added the info board to {channel.mention}.')
+        await self.update_board(channels=[channel.id])
+
+    @board_command.command(name='remove')
+    @commands.has_permissions(administrator=True)
+    async def board_remove(self, ctx, channel: discord.TextChannel = None):
+        channel = channel or ctx.channel
+        if not self.board.remove(channel.id):
+            return await ctx.channel.send(f'{channel.mention} doesn\'t have the info board.')
+
+        self.published = {k : h for k, h in self.published.items() if k[0] != channel.id}
+        await ctx.channel.send(f'Removed the info board from {channel.mention}.')
+
+
+    @property
+    def live(self):
+        '''
+        The viewer's LiveInfo, it answers from the local db.
+        '''
+        viewer = self.bot.get_cog('BandoriViewer')
+        return viewer.live if viewer is not None else self.fallback
+
+    async def thumbnail(self):
+        viewer = self.bot.get_cog('BandoriViewer')
+        if viewer is not None:
+            items = await self.repo.run(viewer.db.get, 'items', [], timeout=None)
+            if items:
+                return items[0]
+        return (await self.repo.get_items(id=[1]))[0]
+
+
+    async def active_gachas(self):
+        current = await self.live.active_gachas()
+
         gachas = [(e.name, e.id, e) for e in current]
         embed = discord.Embed(title='__Bandori current active gachas__')
         for gacha in gachas:
             embed.add_field(name = gacha[0],
                 value = f'id: {gacha[1]}\n{gacha[2].get_start_date().strftime("%m/%d/%Y")} - {gacha[2].get_end_date().strftime("%m/%d/%Y")}',
                 inline=False)
-        
-        image = self.bapi.get_items(id=[1])[0]
+
+        image = await self.thumbnail()
         embed.set_thumbnail(url=image.image)
 
-        try:
-            message = await channel.fetch_message(BandoriTasks.MESSAGE_IDS['g'])
-            await message.edit(embed=embed)
-        
-        except Exception as e:
-            m = await channel.send(embed=embed)
-            BandoriTasks.MESSAGE_IDS['g'] = m.id
+        return embed
 
-    async def active_events(self, channel):
-        event = self.bapi.get_current_event()
+    async def active_events(self):
+        current = await self.live.current_event()
+        if current is None:
+            return None
+        event, main, boost = current
 
         embed = discord.Embed(title = 'Current ongoing event:\n' + event.name)
 
-        main = event.get_main_card()
-        boostm = [m.name for m in event.get_boost_members()]
+        boostm = [m.name for m in boost]
         start = event.get_start_date().strftime("%m/%d/%Y")
         end = event.get_end_date().strftime("%m/%d/%Y")
-        
+
         embed.set_image(url=event.data['english_image'])
         embed.set_thumbnail(url=main.image_trained)
 
@@ -70,18 +227,11 @@ class BandoriTasks(commands.Cog):
         embed.add_field(name = 'Type', value = event.type)
         embed.add_field(name = 'Date', value = f'From {start}\nto {end}', inline=False)
         embed.add_field(name = 'Main card', value = (main.name, main.id), inline=False)
-        
+
         embed.add_field(name = 'Boost attribute', value = event.boost_attribute, inline=False)
         embed.add_field(name = 'Boost members', value = boostm, inline=False)
 
-
-        try:
-            message = await channel.fetch_message(BandoriTasks.MESSAGE_IDS['e'])
-            await message.edit(embed=embed)
-        
-        except Exception as e:
-            m = await channel.send(embed=embed)
-            BandoriTasks.MESSAGE_IDS['e'] = m.id
+        return embed
 
 
 
@@ -1,5 +1,10 @@
 from dotenv import load_dotenv
 from discord.ext import commands
+from utils.repository import BandoriRepository
+from utils.http import HTTPClient
+from utils.reactions import ReactionRouter
+from utils.edits import EditCoalescer
+from utils.metrics import Metrics
 import discord
 import os
 
@@ -10,6 +15,17 @@ cogs = ['bandori',
 load_dotenv()
 token = os.getenv('TOKEN')
 bot = commands.Bot(command_prefix=';')
+# command, task and api timings, cache hit rates and event loop lag, see ;stats.
+bot.metrics = Metrics()
+bot.metrics.attach(bot)
+bot.http_client = HTTPClient()
+bot.repository = BandoriRepository(bot.http_client, metrics=bot.metrics)
+# one reaction listener for every paginator.
+bot.reactions = ReactionRouter(bot)
+# message edits, merged and kept under the rate limits.
+bot.edits = EditCoalescer(bot)
+bot.metrics.track('discord_edits_total', 'outcome', lambda: bot.edits.stats)
+bot.metrics.start(bot.loop)
 
 for cog in [ 'cogs.' + _ for _ in cogs]:
     try:
@@ -33,7 +49,17 @@ async def clean(ctx, limit: int):
 @commands.is_owner()
 async def quit(ctx):
     await ctx.message.delete()
+    bot.reactions.stop()
+    bot.edits.close()
+    bot.metrics.close()
+    await bot.http_client.close()
     await bot.close()
+    bot.repository.close()
+
+@bot.command(name='stats')
+@commands.is_owner()
+async def stats(ctx):
+    await ctx.channel.send(f'```{bot.metrics.summary()[:1990]}```')
 
 @bot.command(name='load')
 @commands.is_owner()
@@ -0,0 +1,174 @@
+from collections import OrderedDict, Counter
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import os
+
+
+class AudioCache:
+    '''
+    Disk cache for bandori bgm files, shared by every guild.
+
+    Files are named by a hash of their url and evicted least recently
+    played first once the cache grows past max_bytes. Play counts are
+    kept so the most played songs can be downloaded ahead of time.
+    '''
+
+    PLAYS_FILE = 'plays.json'
+    # play counts are written at most this often (and after downloads and on close).
+    SAVE_INTERVAL = 60      # seconds
+
+    def __init__(self, path, max_bytes, http):
+        self.path = path
+        self.http = http
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key : size, least recently used first
+        self.size = 0
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+
+        # recency survives restarts through the files' mtimes.
+        files = [f for f in os.scandir(path) if f.name.endswith('.mp3')]
+        for f in sorted(files, key=lambda f: f.stat().st_mtime):
+            self.entries[f.name[:-4]] = f.stat().st_size
+            self.size += f.stat().st_size
+
+        try:
+            with open(os.path.join(path, AudioCache.PLAYS_FILE)) as handle:
+                self.plays = Counter(json.load(handle))
+        except (OSError, ValueError):
+            self.plays = Counter()
+        self.plays_dirty = False
+        self.plays_saved = time.monotonic()
+
+        self.evict()
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.path, key + '.mp3')
+
+    def get(self, url):
+        '''
+        Path of the cached file for url, or None. Counts as a hit or miss.
+        '''
+        path = self._lookup(AudioCache.key(url))
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return path
+
+    def _lookup(self, key):
+        # get() without touching the hit/miss counters.
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+        path = self.file(key)
+        try:
+            os.utime(path)
+        except OSError:
+            # deleted behind our back.
+            self.size -= self.entries.pop(key)
+            return None
+
+        return path
+
+    async def fetch(self, url):
+        '''
+        Download url into the cache and return its path, or None on failure.
+        Concurrent fetches of the same url share one download.
+        Not counted as a hit or miss, the caller looked it up with get() already.
+        '''
+        key = AudioCache.key(url)
+        path = self._lookup(key)
+        if path is not None:
+            return path
+
+        if key not in self.pending:
+            self.pending[key] = asyncio.ensure_future(self._download(url, key))
+
+        try:
+            return await asyncio.shield(self.pending[key])
+        except Exception:
+            logging.error(f'Could not cache {url}', exc_info=True)
+            return None
+
+    async def _download(self, url, key):
+        path = self.file(key)
+        tmp = path + '.part'
+
+        try:
+            async with self.http.session.get(url) as resp:
+                if resp.status != 200:
+                    raise OSError(f'Got {resp.status} from {url}')
+
+                with open(tmp, 'wb') as outf:
+                    async for chunk in resp.content.iter_chunked(64 * 1024):
+                        outf.write(chunk)
+
+            os.replace(tmp, path)
+        finally:
+            self.pending.pop(key, None)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        size = os.path.getsize(path)
+        self.entries[key] = size
+        self.size += size
+        self.evict()
+        self.save_plays()
+
+        return path
+
+    def evict(self):
+        # never evict the file that was just added.
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.file(key))
+            except OSError:
+                pass
+
+    def record_play(self, url):
+        self.plays[url] += 1
+        self.plays_dirty = True
+
+        if time.monotonic() - self.plays_saved > AudioCache.SAVE_INTERVAL:
+            self.save_plays()
+
+    def save_plays(self):
+        if not self.plays_dirty:
+            return
+
+        path = os.path.join(self.path, AudioCache.PLAYS_FILE)
+        try:
+            with open(path + '.tmp', 'w') as handle:
+                json.dump(self.plays, handle)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            logging.warning('Could not save the song play counts.', exc_info=True)
+            return
+
+        self.plays_dirty = False
+        self.plays_saved = time.monotonic()
+
+    def close(self):
+        self.save_plays()
+
+    async def prewarm(self, n):
+        '''
+        Download the n most played songs that aren't cached yet.
+        '''
+        for url, _ in self.plays.most_common(n):
+            if AudioCache.key(url) not in self.entries:
+                await self.fetch(url)
@@ -0,0 +1,66 @@
+import json
+import os
+
+
+class BoardConfig:
+    '''
+    Channels showing the info board and the ids of the board's messages in
+    each of them, saved as json so a restart edits the same messages again.
+
+    {channel id : {board key : message id}}
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        try:
+            with open(path) as handle:
+                self.channels = {int(channel) : messages for channel, messages in json.load(handle).items()}
+        except (OSError, ValueError):
+            self.channels = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as handle:
+            json.dump(self.channels, handle, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+    def add(self, channel_id):
+        if channel_id in self.channels:
+            return False
+        self.channels[channel_id] = {}
+        self.save()
+        return True
+
+    def remove(self, channel_id):
+        if self.channels.pop(channel_id, None) is None:
+            return False
+        self.save()
+        return True
+
+    def message(self, channel_id, key):
+        return self.channels.get(channel_id, {}).get(key)
+
+    def set_message(self, channel_id, key, message_id):
+        if channel_id in self.channels:
+            self.channels[channel_id][key] = message_id
+            self.save()
+
+
+class BoardMessage:
+    '''
+    Stands in for a board message we only know the ids of, so it can be
+    edited (through bot.edits) without fetching it first.
+    '''
+
+    class Channel:
+        def __init__(self, id):
+            self.id = id
+
+    def __init__(self, bot, channel_id, message_id):
+        self.bot = bot
+        self.id = message_id
+        self.channel = BoardMessage.Channel(channel_id)
+
+    async def edit(self, embed):
+        await self.bot.http.edit_message(self.channel.id, self.id, embed=embed.to_dict())
@@ -0,0 +1,169 @@
+from utils.cache import LRUCache
+from utils.search import SearchIndex
+from utils.columns import Columns, CARD_COLUMNS
+from utils.query import CONDITIONS, matches
+
+
+def freeze(filters):
+    '''
+    Hashable form of a filters dict, ignoring unset (None) filters.
+    Already frozen filters (Query.filters) are used as they are.
+    '''
+    if isinstance(filters, frozenset):
+        return filters
+    return frozenset((k, v) for k, v in filters.items() if v is not None)
+
+
+class Catalog:
+    '''
+    Indexed, read-only view over the bandori db lists.
+
+    Built once when the db is loaded or rebuilt, over the compact records
+    from utils.records. Gives O(1) lookups by id
+    and by (case-folded) name, and keeps secondary indexes on the fields
+    the commands filter on, so neither lookups nor filters have to scan
+    the whole collection.
+    '''
+
+    QUERY_CACHE_SIZE = 256
+    EMBED_CACHE_SIZE = 512
+
+    # collection : (name attribute, indexed record fields)
+    SCHEMA = {
+        'cards' : ('name', ('i_rarity', 'i_attribute', 'i_skill_type', 'member')),
+        'members' : ('name', ('i_school_year', 'i_band')),
+        'songs' : ('title', ('bandId',))
+    }
+
+    # collection : columns kept for range filters and sorting, see utils.columns
+    COLUMNS = {
+        'cards' : CARD_COLUMNS
+    }
+
+    # collection : names the search index covers
+    SEARCH_FIELDS = {
+        'cards' : ('name', 'japanese_name'),
+        'members' : ('name', 'japanese_name'),
+        'songs' : ('title',)
+    }
+
+    def __init__(self, db):
+        self.items = {}
+        self.ids = {}
+        self.names = {}
+        self.indexes = {}
+        # filtered results, shared by every paginator. A rebuild makes a new Catalog,
+        # which is what invalidates it.
+        self.query_cache = LRUCache(Catalog.QUERY_CACHE_SIZE)
+        # rendered embeds, (kind, id, trained) : discord.Embed, same lifetime as the queries.
+        self.embeds = LRUCache(Catalog.EMBED_CACHE_SIZE)
+
+        for kind, (name_attr, fields) in Catalog.SCHEMA.items():
+            self._build(kind, db.get(kind, []), name_attr, fields)
+
+        self.search = {kind : SearchIndex(self.items[kind], attrs) for kind, attrs in Catalog.SEARCH_FIELDS.items()}
+        self.columns = {kind : Columns(self.items[kind], columns) for kind, columns in Catalog.COLUMNS.items()}
+
+        # names shown on card embeds, so they never need an api call.
+        self.member_names = {m.id : m.name for m in self.items['members']}
+        self.member_bands = {m.id : m.i_band for m in self.items['members']}
+
+    def _build(self, kind, objs, name_attr, fields):
+        items = list(objs)
+        ids = {}
+        names = {}
+        indexes = {field : {} for field in fields}
+
+        for pos, obj in enumerate(items):
+            # first object wins, like the old linear scans did.
+            ids.setdefault(obj.id, obj)
+
+            name = getattr(obj, name_attr, None)
+            if name is not None:
+                names.setdefault(name.casefold(), obj)
+
+            for field, index in indexes.items():
+                value = getattr(obj, field, None)
+                try:
+                    index.setdefault(value, []).append(pos)
+                except TypeError:
+                    # unhashable values can't be filtered on by equality anyway.
+                    pass
+
+        self.items[kind] = items
+        self.ids[kind] = ids
+        self.names[kind] = names
+        self.indexes[kind] = indexes
+
+    def get(self, kind, id):
+        '''
+        Object with this id, or None.
+        '''
+        return self.ids[kind].get(id)
+
+    def find(self, kind, name):
+        '''
+        Object whose name matches exactly (capitals not considered), or None.
+        '''
+        if name is None:
+            return None
+        return self.names[kind].get(name.casefold())
+
+    def query(self, kind, filters={}, sort=None):
+        '''
+        All objects matching every non-None filter, in db order unless sorted.
+        A filter is a plain value (equality) or a condition from utils.query,
+        sort is (field, descending) or None.
+        The result is a cached tuple, don't expect a fresh list.
+        '''
+        key = (kind, freeze(filters), sort)
+        result = self.query_cache.get(key)
+
+        if result is None:
+            result = tuple(self._query(kind, key[1], sort))
+            self.query_cache.put(key, result)
+
+        return result
+
+    def _query(self, kind, active, sort=None):
+        items = self.items[kind]
+
+        if not active and sort is None:
+            return items
+
+        indexes = self.indexes[kind]
+        columns = self.columns.get(kind)
+
+        # equality on indexed fields goes through the indexes, conditions
+        # through the columns, and anything else is checked object by object.
+        indexed = [indexes[k].get(v, []) for k, v in active
+                   if k in indexes and not isinstance(v, CONDITIONS)]
+        columnar = [(k, v) for k, v in active if columns is not None and k in columns
+                    and (k not in indexes or isinstance(v, CONDITIONS))]
+        unindexed = [(k, v) for k, v in active if (k not in indexes or isinstance(v, CONDITIONS))
+                     and (columns is None or k not in columns)]
+
+        if indexed:
+            indexed.sort(key=len)
+            positions = indexed[0]
+            for other in indexed[1:]:
+                other = set(other)
+                positions = [p for p in positions if p in other]
+        else:
+            positions = range(len(items))
+
+        if columnar:
+            positions = columns.select(positions, columnar)
+
+        if unindexed:
+            positions = [p for p in positions
+                         if all(matches(v, getattr(items[p], k, None)) for k, v in unindexed)]
+
+        if sort is not None:
+            field, descending = sort
+            if columns is not None and field in columns:
+                positions = columns.order(positions, field, descending)
+            else:
+                positions = sorted(positions, key=lambda p: getattr(items[p], field), reverse=descending)
+
+        return [items[p] for p in positions]
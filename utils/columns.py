@@ -0,0 +1,134 @@
+from array import array
+from datetime import date
+from utils.query import Range, OneOf, Not
+
+
+# stands in for a missing number, below anything a range can ask for.
+MISSING = -2 ** 62
+
+
+def stat(name):
+    '''
+    Highest value of a stat, trained if the card can be trained.
+    '''
+    def get(card):
+        trained = getattr(card, f'{name}_trained_max', None)
+        return trained if trained is not None else getattr(card, f'{name}_max', None)
+    return get
+
+
+def total(card):
+    stats = [stat(name)(card) for name in ('performance', 'technique', 'visual')]
+    return None if None in stats else sum(stats)
+
+
+def release_day(card):
+    '''
+    Release date as a day number (date.toordinal), or None.
+    '''
+    try:
+        return date.fromisoformat(card.release_date[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def attr(name):
+    return lambda obj: getattr(obj, name, None)
+
+
+# column : how to get it from a card record
+CARD_COLUMNS = {
+    'id' : attr('id'),
+    'member' : attr('member'),
+    'i_rarity' : attr('i_rarity'),
+    'i_attribute' : attr('i_attribute'),
+    'i_skill_type' : attr('i_skill_type'),
+    'performance' : stat('performance'),
+    'technique' : stat('technique'),
+    'visual' : stat('visual'),
+    'total' : total,
+    'release' : release_day
+}
+
+
+class Columns:
+    '''
+    One collection stored column by column, for range filters and sorting.
+
+    Number columns are arrays of ints (MISSING where a record has none),
+    other columns are arrays of small codes with a value : code table, so
+    comparing a record only costs an array lookup and an int comparison.
+    Everything works on record positions, like Catalog's indexes.
+    '''
+
+    def __init__(self, objs, columns):
+        self.numbers = {}
+        self.codes = {}         # column : (value : code)
+        self.coded = {}
+
+        for name, get in columns.items():
+            values = [get(obj) for obj in objs]
+
+            if all(v is None or (isinstance(v, int) and not isinstance(v, bool)) for v in values):
+                self.numbers[name] = array('q', [MISSING if v is None else v for v in values])
+            else:
+                table = {}
+                self.coded[name] = array('h', [table.setdefault(v, len(table)) for v in values])
+                self.codes[name] = table
+
+    def __contains__(self, name):
+        return name in self.numbers or name in self.coded
+
+    def _predicate(self, name, condition):
+        '''
+        Test on a single column value, with the condition's values turned into codes if needed.
+        '''
+        if isinstance(condition, Not):
+            test = self._predicate(name, condition.condition)
+            return lambda v: not test(v)
+
+        if name in self.numbers:
+            if isinstance(condition, Range):
+                lo = MISSING + 1 if condition.lo is None else condition.lo
+                hi = -MISSING if condition.hi is None else condition.hi
+                return lambda v: lo <= v <= hi
+            if isinstance(condition, OneOf):
+                values = condition.values
+                return values.__contains__
+            return lambda v: v == condition
+
+        table = self.codes[name]
+        if isinstance(condition, Range):
+            raise ValueError(f'{name} has no order, it can\'t take a range')
+        if isinstance(condition, OneOf):
+            # values nobody has get no code and can't match.
+            return {table[v] for v in condition.values if v in table}.__contains__
+        code = table.get(condition, -1)
+        return lambda v: v == code
+
+    def select(self, positions, conditions):
+        '''
+        The positions whose values meet every (column, condition).
+        '''
+        for name, condition in conditions:
+            column = self.numbers[name] if name in self.numbers else self.coded[name]
+            test = self._predicate(name, condition)
+            positions = [p for p in positions if test(column[p])]
+
+        return positions
+
+    def order(self, positions, name, descending=False):
+        '''
+        positions sorted on a column, records without a value always go last.
+        Ties keep their db order.
+        '''
+        if name in self.numbers:
+            column = self.numbers[name]
+            present = [p for p in positions if column[p] != MISSING]
+            missing = [p for p in positions if column[p] == MISSING]
+            return sorted(present, key=column.__getitem__, reverse=descending) + missing
+
+        # coded columns sort on the values themselves.
+        column = self.coded[name]
+        values = {code : value for value, code in self.codes[name].items()}
+        return sorted(positions, key=lambda p: str(values[column[p]]), reverse=descending)
@@ -0,0 +1,175 @@
+from concurrent.futures import ThreadPoolExecutor
+import youtube_dl
+import asyncio
+import hashlib
+import logging
+import glob
+import uuid
+import os
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class DownloadJob:
+    '''
+    One youtube-dl download, shared by everyone who asked for the same url.
+    '''
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.title = url
+        self.progress = 0.0
+        self.refs = 0
+        self.cancelled = False
+        self.future = None
+
+    @property
+    def done(self):
+        return self.future.done()
+
+    async def wait(self):
+        '''
+        Path of the finished mp3. Waiting can be cancelled without cancelling the job.
+        '''
+        return await asyncio.shield(self.future)
+
+    def hook(self, d):
+        # called by youtube-dl from the worker thread.
+        if self.cancelled:
+            raise DownloadCancelled(self.url)
+
+        if d['status'] == 'downloading':
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                self.progress = d.get('downloaded_bytes', 0) / total
+        elif d['status'] == 'finished':
+            self.progress = 1.0
+
+
+class DownloadManager:
+    '''
+    Runs youtube-dl on its own bounded thread pool.
+
+    Every download gets its own output path, two requests for the same url
+    share one job, and a job nobody needs anymore is cancelled (or its file
+    deleted once it's done). Stream lookups for streaming playback share
+    the same pool.
+    '''
+
+    MAX_WORKERS = 2
+
+    YDL_OPTS = {'format': 'bestaudio/best', 'default_search': 'ytsearch', 'noplaylist': True, 'quiet': True}
+
+    def __init__(self, path, max_workers=MAX_WORKERS):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='youtube-dl')
+        self.jobs = {}
+        self.lookups = {}
+
+        os.makedirs(path, exist_ok=True)
+
+    def download(self, url):
+        '''
+        The job downloading url, started if nobody asked for it yet.
+        Every call takes a reference, hand it back with release().
+        '''
+        job = self.jobs.get(url)
+
+        if job is None or job.cancelled:
+            # unique per job, a cancelled job's cleanup must not delete a newer job's file for the same url.
+            name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '-' + uuid.uuid4().hex[:12]
+            job = DownloadJob(url, os.path.join(self.path, name + '.mp3'))
+            job.future = asyncio.get_event_loop().run_in_executor(self.executor, self._download, job)
+            job.future.add_done_callback(lambda f: self._finished(job))
+            self.jobs[url] = job
+
+        job.refs += 1
+        return job
+
+    def release(self, job):
+        job.refs -= 1
+        if job.refs > 0:
+            return
+
+        if self.jobs.get(job.url) is job:
+            del self.jobs[job.url]
+
+        if not job.done:
+            logging.info(f'Cancelling download of {job.url}')
+            job.cancelled = True
+            job.future.cancel()
+        else:
+            self._remove(job)
+
+    async def resolve(self, url):
+        '''
+        youtube-dl info for url (or a search) without downloading it,
+        info['url'] is the direct audio stream.
+        '''
+        if url not in self.lookups:
+            future = asyncio.get_event_loop().run_in_executor(self.executor, self._resolve, url)
+            future.add_done_callback(lambda f: self.lookups.pop(url, None))
+            self.lookups[url] = future
+
+        return await asyncio.shield(self.lookups[url])
+
+    def close(self):
+        for job in list(self.jobs.values()):
+            job.cancelled = True
+            job.future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _finished(self, job):
+        if job.future.cancelled() or job.future.exception() is not None:
+            if self.jobs.get(job.url) is job:
+                del self.jobs[job.url]
+
+
+    ##### these run on the download pool.
+
+    def _download(self, job):
+        if job.cancelled:
+            raise DownloadCancelled(job.url)
+
+        base = os.path.splitext(job.path)[0]
+        ydl_opts = dict(DownloadManager.YDL_OPTS, outtmpl=base + '.%(ext)s', progress_hooks=[job.hook],
+                        postprocessors=[{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}])
+
+        try:
+            with youtube_dl.YoutubeDL(ydl_opts) as ydl:
+                print('Downloading audio')
+                info = ydl.extract_info(job.url, download=True)
+
+            if 'entries' in info:
+                info = info['entries'][0]
+            job.title = info.get('title', job.url)
+
+        except BaseException:
+            self._remove(job)
+            raise
+
+        if job.cancelled:
+            self._remove(job)
+            raise DownloadCancelled(job.url)
+
+        return job.path
+
+    def _resolve(self, url):
+        with youtube_dl.YoutubeDL(DownloadManager.YDL_OPTS) as ydl:
+            info = ydl.extract_info(url, download=False)
+
+        if 'entries' in info:
+            info = info['entries'][0]
+
+        return info
+
+    def _remove(self, job):
+        # the job's files only: its mp3 and whatever youtube-dl left next to it (.webm, .part).
+        for path in glob.glob(glob.escape(os.path.splitext(job.path)[0]) + '.*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
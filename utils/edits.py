@@ -0,0 +1,175 @@
+from collections import deque, Counter
+import discord
+import asyncio
+import logging
+import time
+
+
+class RateBucket:
+    '''
+    Token bucket for one discord route: rate requests every per seconds.
+    '''
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def take(self):
+        '''
+        Takes a token, returns how long to wait before using it.
+        '''
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        self.tokens -= 1
+
+        wait = 0 if self.tokens >= 0 else -self.tokens * self.per / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        # discord said 429, nothing goes out on this route for a while.
+        self.blocked_until = time.monotonic() + seconds
+        self.tokens = 0
+
+
+class PendingEdit:
+    __slots__ = ('message', 'fields', 'futures')
+
+    def __init__(self, message, fields):
+        self.message = message
+        self.fields = fields
+        self.futures = []
+
+
+class EditCoalescer:
+    '''
+    Sends message edits and reaction removals for the whole bot.
+
+    Edits to a message that haven't gone out yet are merged into one (the
+    latest value of every field wins), so flipping through a paginator
+    quickly costs one edit instead of one per click. Every channel gets a
+    bucket per route that stays under discord's limits, instead of running
+    into 429s which stall every other request of the bot.
+    '''
+
+    # (requests, seconds) per channel.
+    RATES = {
+        'edit' : (5, 5.0),
+        'reaction' : (4, 1.0)
+    }
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.pending = {}   # key : PendingEdit
+        self.queues = {}    # (route, channel id) : deque of keys
+        self.buckets = {}
+        self.workers = {}
+        self.stats = Counter(requested=0, merged=0, sent=0, dropped=0, rate_limited=0)
+
+    def edit(self, message, **fields):
+        '''
+        Edit message with the same arguments as Message.edit, once its channel allows it.
+        Returns a future that is True once it was sent, None if the message is gone
+        and False if it was dropped for any other reason.
+        '''
+        return self._submit('edit', ('edit', message.id), message, fields)
+
+    def remove_reaction(self, message, emoji, member):
+        return self._submit('reaction', ('reaction', message.id, str(emoji), member.id),
+                            message, {'emoji' : emoji, 'member' : member})
+
+    def _submit(self, route, key, message, fields):
+        self.stats['requested'] += 1
+        future = self.bot.loop.create_future()
+
+        job = self.pending.get(key)
+        if job is not None:
+            self.stats['merged'] += 1
+            job.fields.update(fields)
+        else:
+            job = self.pending[key] = PendingEdit(message, dict(fields))
+            self._queue(route, message.channel.id).append(key)
+
+        job.futures.append(future)
+        self._start(route, message.channel.id)
+        return future
+
+    def _queue(self, route, channel_id):
+        return self.queues.setdefault((route, channel_id), deque())
+
+    def _start(self, route, channel_id):
+        bucket = (route, channel_id)
+        worker = self.workers.get(bucket)
+        if worker is None or worker.done():
+            self.buckets.setdefault(bucket, RateBucket(*EditCoalescer.RATES[route]))
+            self.workers[bucket] = self.bot.loop.create_task(self._work(route, channel_id))
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+        for job in self.pending.values():
+            self._resolve(job, False)
+        self.pending.clear()
+
+    @staticmethod
+    def _resolve(job, sent):
+        for future in job.futures:
+            if not future.done():
+                future.set_result(sent)
+
+    async def _send(self, route, job):
+        if route == 'edit':
+            await job.message.edit(**job.fields)
+        else:
+            await job.message.remove_reaction(job.fields['emoji'], job.fields['member'])
+
+    async def _work(self, route, channel_id):
+        bucket = self.buckets[(route, channel_id)]
+        queue = self._queue(route, channel_id)
+
+        while queue:
+            await asyncio.sleep(bucket.take())
+
+            key = queue.popleft()
+            job = self.pending.pop(key)
+
+            try:
+                await self._send(route, job)
+            except discord.NotFound:
+                self.stats['dropped'] += 1
+                self._resolve(job, None)
+                continue
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    logging.warning(f'Could not {route} message {job.message.id}: {e}')
+                    self.stats['dropped'] += 1
+                    self._resolve(job, False)
+                    continue
+
+                self.stats['rate_limited'] += 1
+                retry_after = float(e.response.headers.get('Retry-After', 1))
+                bucket.block(retry_after)
+
+                # try again, with anything that came in meanwhile on top.
+                newer = self.pending.get(key)
+                if newer is not None:
+                    self.stats['merged'] += 1
+                    newer.fields = {**job.fields, **newer.fields}
+                    newer.futures.extend(job.futures)
+                else:
+                    self.pending[key] = job
+                    queue.appendleft(key)
+                continue
+            except Exception:
+                logging.error(f'Could not {route} message {job.message.id}', exc_info=True)
+                self.stats['dropped'] += 1
+                self._resolve(job, False)
+                continue
+
+            self.stats['sent'] += 1
+            self._resolve(job, True)
+
+        del self.workers[(route, channel_id)]
@@ -0,0 +1,40 @@
+import aiohttp
+import logging
+
+
+class HTTPClient:
+    '''
+    The bot-wide aiohttp session.
+
+    One pooled, keep-alive session for all outbound http (api calls,
+    rebuilds, song downloads), so connections, DNS lookups and TLS
+    sessions are reused instead of set up for every request.
+    '''
+
+    LIMIT = 64              # open connections in total
+    LIMIT_PER_HOST = 8      # open connections per host
+    DNS_CACHE_TTL = 300     # seconds
+
+    # no total limit, big downloads are fine as long as bytes keep coming.
+    TIMEOUT = aiohttp.ClientTimeout(total=None, connect=10, sock_read=30)
+
+    def __init__(self):
+        self._session = None
+
+    @property
+    def session(self):
+        '''
+        The shared session, made on first use (it has to be made inside the running loop).
+        '''
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=HTTPClient.LIMIT,
+                                             limit_per_host=HTTPClient.LIMIT_PER_HOST,
+                                             ttl_dns_cache=HTTPClient.DNS_CACHE_TTL)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=HTTPClient.TIMEOUT)
+            logging.info('Opened the shared http session.')
+
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+import logging
+
+
+class LiveInfo:
+    '''
+    The current event and active gachas, worked out from the local db.
+
+    Events and gachas have known start and end dates, so an answer is kept
+    until the next start/end date (or TTL, whichever comes first) instead
+    of asking the api every time. The api is only used when the db doesn't
+    know about anything current, e.g. before the first rebuild.
+    '''
+
+    TTL = timedelta(hours=1)
+
+    def __init__(self, repo, get_db):
+        self.repo = repo
+        # returns the current (db, catalog), which a rebuild swaps out.
+        self.get_db = get_db
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.cache.clear()
+
+    async def _cached(self, key, compute):
+        now = datetime.utcnow()
+        entry = self.cache.get(key)
+
+        if entry is not None and now < entry[1]:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        value = await compute(now)
+        self.cache[key] = (value, min(now + LiveInfo.TTL, self.next_boundary(now) or now + LiveInfo.TTL))
+        return value
+
+    async def _collection(self, name):
+        db, _ = self.get_db()
+        # may have to be unpickled, keep that off the loop.
+        return await self.repo.run(db.get, name, [], timeout=None)
+
+
+    ##### dates
+
+    @staticmethod
+    def event_dates(event):
+        start, end = event.get_start_date(), event.get_end_date()
+        if start == -1 or end == -1:
+            return None
+        return start, end
+
+    @staticmethod
+    def gacha_dates(gacha):
+        try:
+            return (datetime.utcfromtimestamp(int(gacha.start_date) / 1000),
+                    datetime.utcfromtimestamp(int(gacha.end_date) / 1000))
+        except (TypeError, ValueError):
+            return None
+
+    def boundaries(self):
+        '''
+        Every known start and end date of the stored events and gachas.
+        Only looks at collections that are already loaded.
+        '''
+        db, _ = self.get_db()
+        dates = []
+
+        for name, get_dates in (('events', LiveInfo.event_dates), ('gachas', LiveInfo.gacha_dates)):
+            if getattr(db, 'is_loaded', lambda name: True)(name):
+                for obj in db.get(name, []):
+                    d = get_dates(obj)
+                    if d is not None:
+                        dates.extend(d)
+
+        return dates
+
+    def next_boundary(self, now=None):
+        now = now or datetime.utcnow()
+        upcoming = [d for d in self.boundaries() if d > now]
+        return min(upcoming, default=None)
+
+
+    ##### current event
+
+    async def current_event(self):
+        '''
+        (event, main card, boost members) of the ongoing event, or None.
+        '''
+        return await self._cached('event', self._current_event)
+
+    async def _current_event(self, now):
+        _, catalog = self.get_db()
+        ongoing = []
+
+        for event in await self._collection('events'):
+            d = LiveInfo.event_dates(event)
+            if d is not None and d[0] <= now < d[1]:
+                ongoing.append((d[0], event))
+
+        if not ongoing:
+            logging.info('No ongoing event in the db, asking the api.')
+            event = await self.repo.get_current_event()
+            if event is None:
+                return None
+        else:
+            event = max(ongoing, key=lambda e: e[0])[1]
+
+        main = catalog.get('cards', event.main_card)
+        boost = [catalog.get('members', id) for id in event.boost_members or []]
+
+        if main is None or None in boost:
+            main, boost = await self.repo.get_event_details(event)
+
+        return event, main, boost
+
+
+    ##### active gachas
+
+    async def active_gachas(self):
+        return await self._cached('gachas', self._active_gachas)
+
+    async def _active_gachas(self, now):
+        active = []
+        for gacha in await self._collection('gachas'):
+            d = LiveInfo.gacha_dates(gacha)
+            if d is not None and d[0] <= now < d[1]:
+                active.append(gacha)
+
+        # no db yet, or it's older than the current gachas.
+        if not active:
+            logging.info('No active gachas in the db, asking the api.')
+            return await self.repo.get_active_gachas()
+
+        return active
@@ -0,0 +1,295 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from discord.ext import commands
+import traceback
+import asyncio
+import logging
+import time
+import sys
+import os
+
+
+class Histogram:
+    '''
+    Durations in seconds: cumulative bucket counts for prometheus, and the
+    most recent samples for exact percentiles in ;stats.
+    '''
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+    RECENT = 512
+
+    __slots__ = ('counts', 'sum', 'count', 'max', 'recent')
+
+    def __init__(self):
+        self.counts = [0] * (len(Histogram.BUCKETS) + 1)     # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.recent = deque(maxlen=Histogram.RECENT)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(Histogram.BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, p):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Metrics:
+    '''
+    Bot-wide instrumentation, bot.metrics.
+
+    Commands are timed through the bot's command events, background tasks
+    and api calls with timer(). Caches and other counters already kept
+    somewhere (LRUCache, AudioCache, LiveInfo, bot.edits) are only read
+    when the metrics are shown, through track_cache() and track().
+    A sampler task measures how late the event loop wakes up, which is how
+    long something blocked it.
+
+    Everything is shown by ;stats and written to a prometheus text file
+    every METRICS_INTERVAL seconds (METRICS_FILE, see __init__), for
+    node_exporter's textfile collector or anything else that can scrape a file.
+    '''
+
+    PATH = 'data/metrics.prom'
+    WRITE_INTERVAL = 60     # seconds
+    LAG_INTERVAL = 0.5      # seconds between event loop lag samples
+    PREFIX = 'fleet_'
+
+    HELP = {
+        'command_seconds' : 'Time from a command being invoked to it finishing.',
+        'task_seconds' : 'Duration of background task runs.',
+        'api_request_seconds' : 'Duration of bandori api requests.',
+        'executor_seconds' : 'Duration of blocking calls run on the api thread pool.',
+        'event_loop_lag_seconds' : 'How late the event loop ran a sleep that should have ended on time.',
+        'cache_hits_total' : 'Cache hits.',
+        'cache_misses_total' : 'Cache misses.',
+        'discord_edits_total' : 'Message edits and reaction removals through bot.edits, by outcome.',
+    }
+
+    def __init__(self, path=None):
+        # read here and not at import, main.py loads .env after its imports.
+        self.path = path or os.getenv('METRICS_FILE', Metrics.PATH)
+        self.write_interval = int(os.getenv('METRICS_INTERVAL', Metrics.WRITE_INTERVAL))
+        self.histograms = {}    # (name, labels) : Histogram, labels is a tuple of (key, value)
+        self.errors = {}        # (name, labels) : count
+        self.caches = {}        # name : returns an object with hits and misses
+        self.counters = {}      # name : (label, returns {label value : count})
+        self.started = time.time()
+        self.tasks = []
+
+    ##### recording
+
+    def observe(self, name, seconds, error=False, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+        if error:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''
+        Times the block, which counts as an error if it raises.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - start, error=True, **labels)
+            raise
+        self.observe(name, time.perf_counter() - start, **labels)
+
+    def track_cache(self, name, get):
+        '''
+        get returns the cache (anything with hits and misses), looked up every
+        time so caches that are swapped out (like the catalog's) are followed.
+        '''
+        self.caches[name] = get
+
+    def track(self, name, label, get):
+        '''
+        A counter kept elsewhere, get returns {label value : count}.
+        '''
+        self.counters[name] = (label, get)
+
+    ##### bot and loop
+
+    def attach(self, bot):
+        bot.add_listener(self.on_command, 'on_command')
+        bot.add_listener(self.on_command_completion, 'on_command_completion')
+        bot.add_listener(self.on_command_error, 'on_command_error')
+
+    def start(self, loop):
+        self.tasks = [loop.create_task(self.sample_lag()), loop.create_task(self.write_loop())]
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.write()
+
+    async def on_command(self, ctx):
+        ctx.started = time.perf_counter()
+
+    async def on_command_completion(self, ctx):
+        self._command_done(ctx, False)
+
+    async def on_command_error(self, ctx, error):
+        # a failed check or bad arguments is the user's mistake, not a slow or broken command.
+        if not isinstance(error, (commands.CheckFailure, commands.UserInputError, commands.CommandNotFound)):
+            self._command_done(ctx, True)
+
+        # any on_command_error listener turns off the bot's default handler
+        # (Bot.on_command_error), so print the traceback like it does.
+        if hasattr(ctx.command, 'on_error'):
+            return
+        if ctx.cog is not None and commands.Cog._get_overridden_method(ctx.cog.cog_command_error) is not None:
+            return
+        print(f'Ignoring exception in command {ctx.command}:', file=sys.stderr)
+        traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
+    def _command_done(self, ctx, error):
+        started = getattr(ctx, 'started', None)
+        if started is not None and ctx.command is not None:
+            self.observe('command_seconds', time.perf_counter() - started, error=error,
+                         command=ctx.command.qualified_name)
+
+    async def sample_lag(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(Metrics.LAG_INTERVAL)
+            self.observe('event_loop_lag_seconds', max(0.0, loop.time() - start - Metrics.LAG_INTERVAL))
+
+    async def write_loop(self):
+        while True:
+            await asyncio.sleep(self.write_interval)
+            try:
+                self.write()
+            except OSError:
+                logging.warning(f'Could not write the metrics to {self.path}', exc_info=True)
+
+    ##### output
+
+    def cache_stats(self):
+        '''
+        {cache name : (hits, misses)}
+        '''
+        stats = {}
+        for name, get in self.caches.items():
+            cache = get()
+            if cache is not None:
+                stats[name] = (cache.hits, cache.misses)
+        return stats
+
+    def render(self):
+        '''
+        Everything in the prometheus text format.
+        '''
+        def labels_text(labels):
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in labels) + '}'
+
+        lines = []
+        names = sorted({name for name, _ in self.histograms})
+        for name in names:
+            full = Metrics.PREFIX + name
+            lines.append(f'# HELP {full} {Metrics.HELP.get(name, name)}')
+            lines.append(f'# TYPE {full} histogram')
+
+            for (n, labels), h in sorted(self.histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(Histogram.BUCKETS + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'{full}_bucket{labels_text(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{full}_sum{labels_text(labels)} {h.sum}')
+                lines.append(f'{full}_count{labels_text(labels)} {h.count}')
+
+        if self.errors:
+            full = Metrics.PREFIX + 'errors_total'
+            lines.append(f'# HELP {full} Timed commands, tasks and requests that failed.')
+            lines.append(f'# TYPE {full} counter')
+            for (name, labels), count in sorted(self.errors.items()):
+                lines.append(f'{full}{labels_text((("metric", name),) + labels)} {count}')
+
+        caches = self.cache_stats()
+        for i, name in enumerate(('cache_hits_total', 'cache_misses_total')):
+            full = Metrics.PREFIX + name
+            lines.append(f'# HELP {full} {Metrics.HELP[name]}')
+            lines.append(f'# TYPE {full} counter')
+            for cache, stats in sorted(caches.items()):
+                lines.append(f'{full}{labels_text((("cache", cache),))} {stats[i]}')
+
+        for name, (label, get) in sorted(self.counters.items()):
+            full = Metrics.PREFIX + name
+            lines.append(f'# HELP {full} {Metrics.HELP.get(name, name)}')
+            lines.append(f'# TYPE {full} counter')
+            for value, count in sorted(get().items()):
+                lines.append(f'{full}{labels_text(((label, value),))} {count}')
+
+        lines.append(f'# TYPE {Metrics.PREFIX}uptime_seconds gauge')
+        lines.append(f'{Metrics.PREFIX}uptime_seconds {time.time() - self.started:.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # scrapers must never see half a file.
+        with open(self.path + '.tmp', 'w') as handle:
+            handle.write(self.render())
+        os.replace(self.path + '.tmp', self.path)
+
+    def summary(self):
+        '''
+        Short text version for ;stats.
+        '''
+        def ms(seconds):
+            return f'{seconds * 1000:.0f}ms' if seconds < 10 else f'{seconds:.0f}s'
+
+        lines = [f'Up for {int(time.time() - self.started) // 60} min', '']
+        sections = [('Commands', 'command_seconds'), ('Tasks', 'task_seconds'),
+                    ('Api requests', 'api_request_seconds'), ('Thread pool', 'executor_seconds')]
+
+        for title, name in sections:
+            rows = sorted(((labels, h) for (n, labels), h in self.histograms.items() if n == name),
+                          key=lambda row: -row[1].count)
+            if not rows:
+                continue
+            lines.append(f'{title}:')
+            for labels, h in rows:
+                label = ' '.join(str(v) for _, v in labels) or '-'
+                errors = self.errors.get((name, labels), 0)
+                lines.append(f'  {label:<16} {h.count:>6}  p50 {ms(h.percentile(0.5)):>7}  '
+                             f'p95 {ms(h.percentile(0.95)):>7}  max {ms(h.max):>7}'
+                             + (f'  {errors} failed' if errors else ''))
+            lines.append('')
+
+        lag = self.histograms.get(('event_loop_lag_seconds', ()))
+        if lag is not None:
+            lines.append(f'Event loop lag: p50 {ms(lag.percentile(0.5))}  p99 {ms(lag.percentile(0.99))}  '
+                         f'max {ms(lag.max)}')
+            lines.append('')
+
+        caches = self.cache_stats()
+        if caches:
+            lines.append('Cache hit rates:')
+            for name, (hits, misses) in sorted(caches.items()):
+                rate = f'{hits / (hits + misses):.0%}' if hits + misses else '-'
+                lines.append(f'  {name:<16} {rate:>5}  ({hits} hits, {misses} misses)')
+            lines.append('')
+
+        for name, (label, get) in sorted(self.counters.items()):
+            lines.append(f'{name}: ' + ', '.join(f'{value} {count}' for value, count in sorted(get().items())))
+
+        return '\n'.join(lines).strip()
@@ -0,0 +1,312 @@
+from collections import deque
+from discord.utils import get
+import discord
+import asyncio
+import logging
+
+
+# keep going through short network drops instead of ending the track.
+STREAM_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+
+def audio_source(path_or_url, headers=None):
+    '''
+    Volume-controlled FFmpeg source for a local file or an http url.
+    Urls are streamed, FFmpeg starts playing as soon as the first bytes arrive.
+    '''
+    if path_or_url.startswith('http'):
+        before_options = STREAM_BEFORE_OPTIONS
+        if headers:
+            lines = ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+            before_options += f' -headers "{lines}"'
+        audio = discord.FFmpegPCMAudio(path_or_url, before_options=before_options)
+    else:
+        audio = discord.FFmpegPCMAudio(path_or_url)
+
+    source = discord.PCMVolumeTransformer(audio)
+    source.volume = 1.0
+    return source
+
+
+class Track:
+    '''
+    One entry in a guild's queue: an audio file or stream and what to call it.
+
+    Getting a track ready (resolving, downloading) happens in _prepare(),
+    which the player starts ahead of time for the next few tracks in the
+    queue. The file belongs to someone else (the audio cache), it isn't removed.
+    '''
+
+    def __init__(self, title, location=None, channel=None, headers=None):
+        self.title = title
+        self.location = location
+        self.headers = headers
+        # where to complain if the track can't be played.
+        self.channel = channel
+        self.ready = None
+        self.buffered = None
+
+    def prepare(self):
+        '''
+        Start getting the track ready if that hasn't started yet.
+        Returns the future of it, which raises if the track can't be played.
+        '''
+        if self.ready is None:
+            self.ready = asyncio.ensure_future(self._prepare())
+        return self.ready
+
+    async def _prepare(self):
+        pass
+
+    def buffer(self):
+        '''
+        Start FFmpeg on a ready track now, so it has audio waiting when its turn comes.
+        '''
+        if self.buffered is None and self.ready is not None and self.ready.done() \
+                and not self.ready.cancelled() and self.ready.exception() is None:
+            self.buffered = audio_source(self.location, self.headers)
+
+    def source(self):
+        source, self.buffered = self.buffered, None
+        return source or audio_source(self.location, self.headers)
+
+    def cleanup(self):
+        '''
+        Called once the track is done or dropped from the queue.
+        '''
+        if self.ready is not None and not self.ready.done():
+            self.ready.cancel()
+        if self.buffered is not None:
+            self.buffered.cleanup()
+            self.buffered = None
+
+
+class BgmTrack(Track):
+    '''
+    A bandori bgm, played from the audio cache. On a cache miss it is either
+    streamed while the cache fills in the background, or downloaded first.
+    '''
+
+    def __init__(self, title, cache, url, stream=True, channel=None):
+        super().__init__(title, channel=channel)
+        self.cache = cache
+        self.url = url
+        self.stream = stream
+
+    async def _prepare(self):
+        self.location = self.cache.get(self.url)
+        if self.location is not None:
+            return
+
+        if self.stream:
+            asyncio.ensure_future(self.cache.fetch(self.url))
+            self.location = self.url
+            return
+
+        self.location = await self.cache.fetch(self.url)
+        if self.location is None:
+            raise OSError(f'Could not download {self.url}')
+
+
+class YoutubeTrack(Track):
+    '''
+    A youtube url (or search) streamed from its direct audio url.
+    '''
+
+    def __init__(self, title, manager, url, channel=None):
+        super().__init__(title, channel=channel)
+        self.manager = manager
+        self.url = url
+
+    async def _prepare(self):
+        info = await self.manager.resolve(self.url)
+        self.title = info.get('title', self.url)
+        self.location = info['url']
+        self.headers = info.get('http_headers')
+
+
+class DownloadTrack(Track):
+    '''
+    A youtube track downloaded by the DownloadManager before it plays.
+    The download is cancelled if the track is dropped before it finishes.
+    '''
+
+    def __init__(self, title, manager, url, channel=None, reporter=None):
+        super().__init__(title, channel=channel)
+        self.manager = manager
+        self.url = url
+        self.reporter = reporter
+        self.job = None
+
+    async def _prepare(self):
+        self.job = self.manager.download(self.url)
+        if self.reporter is not None:
+            asyncio.ensure_future(self.reporter(self.job))
+
+        self.location = await self.job.wait()
+        self.title = self.job.title
+
+    def cleanup(self):
+        super().cleanup()
+        if self.job is not None:
+            job, self.job = self.job, None
+            self.manager.release(job)
+
+
+class GuildPlayer:
+    '''
+    Music player for a single guild.
+
+    Owns the guild's queue and loop state, and plays the queue from its
+    own task, so any number of guilds can play at the same time.
+    While a track plays, the next PREFETCH tracks are resolved/downloaded
+    in the background and the very next one is buffered, so enqueueing
+    returns right away and tracks follow each other without a gap.
+    '''
+
+    PREFETCH = 2
+
+    def __init__(self, bot, guild):
+        self.bot = bot
+        self.guild = guild
+        self.queue = deque()
+        self.loop_state = False
+        self.current = None
+        self.preparing = None
+
+        self.wake = asyncio.Event()
+        self.done = asyncio.Event()
+        self.skipping = False
+        self.task = bot.loop.create_task(self.run())
+
+    @property
+    def voice(self):
+        return get(self.bot.voice_clients, guild = self.guild)
+
+    @property
+    def is_playing(self):
+        return self.current is not None
+
+    def add(self, track):
+        self.queue.append(track)
+        self.prefetch()
+        self.wake.set()
+
+    def connected(self):
+        '''
+        The bot joined a voice channel, play what was queued while it wasn't in one.
+        '''
+        self.wake.set()
+
+    def clear(self):
+        while self.queue:
+            self.queue.popleft().cleanup()
+
+    def prefetch(self):
+        for track in list(self.queue)[:GuildPlayer.PREFETCH]:
+            track.prepare()
+
+    def skip(self):
+        '''
+        Stop the current track and go to the next one, even when looping.
+        '''
+        if self.preparing is not None and not self.preparing.done():
+            # still downloading, drop it.
+            self.preparing.cancel()
+            return True
+
+        voice = self.voice
+        if voice and (voice.is_playing() or voice.is_paused()):
+            self.skipping = True
+            voice.stop()
+            return True
+        return False
+
+    def stop(self):
+        self.loop_state = False
+        return self.skip()
+
+    def close(self):
+        self.task.cancel()
+        self.clear()
+        if self.current is not None:
+            self.current.cleanup()
+        voice = self.voice
+        if voice:
+            voice.stop()
+
+    async def run(self):
+        while True:
+            while not self.queue:
+                self.wake.clear()
+                await self.wake.wait()
+
+            self.current = track = self.queue.popleft()
+            self.prefetch()
+            try:
+                # waited on instead of awaited, so skip can cancel it without cancelling us.
+                self.preparing = track.prepare()
+                await asyncio.wait({self.preparing})
+
+                if self.preparing.cancelled():
+                    print(f'Skipped {track.title} before it was ready')
+                else:
+                    self.preparing.result()
+                    if not await self.play(track):
+                        # not in a voice channel, keep it until connected() is called.
+                        self.queue.appendleft(track)
+                        track = None
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.error(f'Error while playing {track.title}', exc_info=True)
+                if track.channel is not None:
+                    await track.channel.send(f'Could not play {track.title}...')
+            finally:
+                self.current = None
+                self.preparing = None
+                if track is not None:
+                    track.cleanup()
+
+            if track is None:
+                self.wake.clear()
+                await self.wake.wait()
+            elif not self.queue:
+                print('No more songs in the queue')
+
+    async def play(self, track):
+        '''
+        Play track (over and over while looping). False if it never played, not being in a voice channel.
+        '''
+        self.skipping = False
+        played = False
+
+        while True:
+            voice = self.voice
+            if not voice or not voice.is_connected():
+                return played
+
+            self.done.clear()
+            voice.play(track.source(), after = self._after)
+            played = True
+            self.bot.loop.create_task(self.buffer_next())
+            await self.done.wait()
+
+            if not self.loop_state or self.skipping:
+                return played
+
+    async def buffer_next(self):
+        if not self.queue:
+            return
+
+        track = self.queue[0]
+        await asyncio.wait({track.prepare()})
+        # still next in line once it's ready?
+        if self.queue and self.queue[0] is track:
+            track.buffer()
+
+    def _after(self, error):
+        # called from the voice thread.
+        if error:
+            logging.error(f'Player error: {error}')
+        self.bot.loop.call_soon_threadsafe(self.done.set)
@@ -0,0 +1,238 @@
+from typing import NamedTuple, Optional
+from datetime import date
+import shlex
+
+
+class QueryError(ValueError):
+    '''
+    A query that could not be read. errors is a list of (option, problem),
+    str() of it is meant to be shown to the user.
+    '''
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+    def __str__(self):
+        return 'Could not read that:\n' + '\n'.join(f'`{option}`: {problem}' for option, problem in self.errors)
+
+
+##### conditions a filter can have instead of a single value, all hashable.
+
+class Range(NamedTuple):
+    lo: object = None    # None for no bound, both ends included
+    hi: object = None
+
+
+class OneOf(NamedTuple):
+    values: frozenset
+
+
+class Not(NamedTuple):
+    condition: object
+
+
+CONDITIONS = (Range, OneOf, Not)
+
+
+def matches(condition, value):
+    '''
+    Whether value meets a filter condition (or equals a plain value).
+    '''
+    if isinstance(condition, Not):
+        return not matches(condition.condition, value)
+    if isinstance(condition, OneOf):
+        return value in condition.values
+    if isinstance(condition, Range):
+        return value is not None and (condition.lo is None or condition.lo <= value) \
+            and (condition.hi is None or value <= condition.hi)
+    return value == condition
+
+
+class Query(NamedTuple):
+    '''
+    A parsed command query. Hashable, filters and sort are what Catalog.query caches on.
+    '''
+    kind: str
+    id: Optional[int] = None
+    trained: bool = False
+    filters: frozenset = frozenset()
+    sort: Optional[tuple] = None     # (field, descending)
+
+
+##### value converters, they raise ValueError with a message for the user.
+
+def integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('must be a number') from None
+
+
+def day(value):
+    '''
+    A yyyy-mm-dd date as a day number, like utils.columns stores release dates.
+    '''
+    try:
+        return date.fromisoformat(value).toordinal()
+    except ValueError:
+        raise ValueError('must be a date like 2020-01-31') from None
+
+
+def choice(values):
+    '''
+    Converter accepting the (case-insensitive) keys of values, returning what they map to.
+    '''
+    accepted = {str(k).casefold() : v for k, v in values.items()}
+    shown = ', '.join(str(k) for k in values)
+
+    def convert(value):
+        try:
+            return accepted[value.casefold()]
+        except KeyError:
+            raise ValueError(f'must be one of {shown}') from None
+
+    return convert
+
+
+def enum(values):
+    '''
+    choice() for an {id : name} dict: both the id and the name are accepted, the name is returned.
+    '''
+    accepted = {str(k) : v for k, v in values.items()}
+    accepted.update({v : v for v in values.values()})
+    return choice(accepted)
+
+
+class Option:
+    '''
+    One --option of a command. field is the catalog field it filters on,
+    options without one (like --id) are handled by the parser itself.
+
+    A multi option takes several values (a,b) and negation (!a, !a,b),
+    a ranged one takes lo..hi, lo.. and ..hi.
+    '''
+
+    __slots__ = ('name', 'field', 'convert', 'flag', 'multi', 'ranged')
+
+    def __init__(self, name, field=None, convert=str, flag=False, multi=False, ranged=False):
+        self.name = name
+        self.field = field
+        self.convert = convert
+        self.flag = flag
+        self.multi = multi
+        self.ranged = ranged
+
+    def parse(self, value):
+        negate = self.multi and value.startswith('!')
+        if negate:
+            value = value[1:]
+
+        if self.ranged and '..' in value:
+            lo, hi = value.split('..', 1)
+            if not lo and not hi:
+                raise ValueError('a range needs at least one end')
+            condition = Range(self.convert(lo) if lo else None, self.convert(hi) if hi else None)
+        elif self.multi and ',' in value:
+            condition = OneOf(frozenset(self.convert(v) for v in value.split(',') if v))
+        else:
+            condition = self.convert(value)
+
+        return Not(condition) if negate else condition
+
+
+class QueryParser:
+    '''
+    Parser for one command's options, set up once and shared by every call.
+
+    Accepts `--option value`, `--option=value` and a bare number as the id.
+    Values with spaces go in double quotes (`--band "RAISE A SUILEN"`),
+    single quotes are left alone since names like Poppin'Party have them.
+    An option given twice is an error, multi options take a,b instead.
+    With sorts ({name : field}) it also takes `--sort name`, `--sort -name`
+    sorting in descending order.
+    Every problem is collected into one QueryError instead of giving up
+    at the first one.
+    '''
+
+    def __init__(self, kind, options, sorts=None):
+        self.kind = kind
+        if sorts:
+            sort_field = choice(sorts)
+            def sort(value):
+                descending = value.startswith('-')
+                return sort_field(value.lstrip('-')), descending
+            options = list(options) + [Option('sort', convert=sort)]
+        self.options = {'--' + option.name : option for option in options}
+
+    @staticmethod
+    def tokenize(message):
+        '''
+        Whitespace separated, "quoted" parts kept together. Raises ValueError for an unclosed quote.
+        '''
+        lexer = shlex.shlex(message, posix=True)
+        lexer.whitespace_split = True
+        lexer.quotes = '"'
+        lexer.escape = ''
+        lexer.commenters = ''
+        return list(lexer)
+
+    def parse(self, message):
+        if not message:
+            return Query(self.kind)
+
+        try:
+            tokens = QueryParser.tokenize(message)
+        except ValueError:
+            raise QueryError([(message, 'a " is never closed')]) from None
+        values = {}
+        errors = []
+        i = 0
+
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+
+            if not token.startswith('--'):
+                if token.isdigit() and 'id' not in values and '--id' in self.options:
+                    values['id'] = int(token)
+                else:
+                    errors.append((token, 'unexpected value'))
+                continue
+
+            name, _, value = token.partition('=')
+            option = self.options.get(name.casefold())
+            if option is None:
+                errors.append((name, f'not an option, try one of {", ".join(self.options)}'))
+                continue
+
+            if option.flag:
+                values[option.name] = True
+                continue
+
+            if option.name in values:
+                errors.append((name, 'given more than once' + (', put the values together: a,b' if option.multi else '')))
+                # skip its value too.
+                if not value and i < len(tokens) and not tokens[i].startswith('--'):
+                    i += 1
+                continue
+
+            if not value:
+                if i >= len(tokens) or tokens[i].startswith('--'):
+                    errors.append((name, 'needs a value'))
+                    continue
+                value = tokens[i]
+                i += 1
+
+            try:
+                values[option.name] = option.parse(value)
+            except ValueError as e:
+                errors.append((name, str(e)))
+
+        if errors:
+            raise QueryError(errors)
+
+        filters = frozenset((self.options['--' + name].field, value) for name, value in values.items()
+                            if self.options['--' + name].field is not None)
+
+        return Query(self.kind, values.get('id'), values.get('trained', False), filters, values.get('sort'))
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import math
+
+
+class ReactionSession:
+    '''
+    A message waiting for its author's reactions.
+
+    handlers maps an emoji to a coroutine function called with (reaction, user),
+    None as a handler closes the session. Every handled reaction restarts the timeout.
+    '''
+
+    __slots__ = ('message_id', 'author_id', 'handlers', 'timeout', 'on_close', 'expires')
+
+    def __init__(self, message_id, author_id, handlers, timeout, on_close=None):
+        self.message_id = message_id
+        self.author_id = author_id
+        self.handlers = handlers
+        self.timeout = timeout
+        self.on_close = on_close
+        self.expires = 0
+
+
+class ReactionRouter:
+    '''
+    One reaction_add listener for every interactive message of the bot.
+
+    Sessions are kept by message id, so a reaction is dispatched with a
+    single dict lookup instead of running through a check per open message.
+    Timeouts are kept on a timer wheel that ticks every TICK seconds: a
+    session sits in the slot of its deadline, and a session that was used
+    in the meantime just moves on to its new slot when its old one comes up.
+    '''
+
+    TICK = 1      # seconds
+    SLOTS = 64
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.sessions = {}
+        self.wheel = [set() for _ in range(ReactionRouter.SLOTS)]
+        self.now = 0
+        self.task = None
+
+        bot.add_listener(self.on_reaction_add, 'on_reaction_add')
+
+    def open(self, message, author, handlers, timeout=20, on_close=None):
+        session = ReactionSession(message.id, author.id, handlers, timeout, on_close)
+        self.sessions[message.id] = session
+        self._touch(session)
+        self.wheel[session.expires % ReactionRouter.SLOTS].add(message.id)
+
+        if self.task is None or self.task.done():
+            self.task = self.bot.loop.create_task(self.run())
+
+        return session
+
+    def close(self, message_id):
+        session = self.sessions.pop(message_id, None)
+        if session is not None and session.on_close is not None:
+            self.bot.loop.create_task(session.on_close())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        for message_id in list(self.sessions):
+            self.close(message_id)
+
+    def _touch(self, session):
+        session.expires = self.now + max(1, math.ceil(session.timeout / ReactionRouter.TICK))
+
+    async def on_reaction_add(self, reaction, user):
+        session = self.sessions.get(reaction.message.id)
+        if session is None or user.bot or user.id != session.author_id:
+            return
+
+        emoji = str(reaction.emoji)
+        if emoji not in session.handlers:
+            return
+
+        handler = session.handlers[emoji]
+        if handler is None:
+            return self.close(session.message_id)
+
+        self._touch(session)
+        try:
+            await handler(reaction, user)
+        except Exception:
+            logging.warning(f'Reaction handler failed on message {session.message_id}', exc_info=True)
+            self.close(session.message_id)
+
+    async def run(self):
+        while self.sessions:
+            await asyncio.sleep(ReactionRouter.TICK)
+            self.now += 1
+
+            slot = self.wheel[self.now % ReactionRouter.SLOTS]
+            due = list(slot)
+            slot.clear()
+
+            for message_id in due:
+                session = self.sessions.get(message_id)
+                if session is None:
+                    continue
+                if session.expires > self.now:
+                    # used since it was put here, or more than a lap away.
+                    self.wheel[session.expires % ReactionRouter.SLOTS].add(message_id)
+                else:
+                    print('Timeout.')
+                    self.close(message_id)
@@ -0,0 +1,219 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from utils.records import compact
+
+
+def record_hash(obj):
+    '''
+    Stable hash of the data behind a pydori object or record.
+    '''
+    raw = json.dumps(obj.data, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class CollectionReport:
+    '''
+    What happened to one collection during a rebuild.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.total = 0
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.error = None
+
+    @property
+    def dirty(self):
+        return self.error is None and (self.added or self.changed or self.removed)
+
+    def __str__(self):
+        if self.error:
+            return f'{self.name:<10} FAILED after {self.seconds:.1f}s ({self.error}), kept old data'
+        return f'{self.name:<10} {self.seconds:6.1f}s  {self.total:>6} total  +{self.added} ~{self.changed} -{self.removed}'
+
+
+class RebuildPipeline:
+    '''
+    Fetches every collection concurrently and diffs it against the current db.
+
+    Unchanged records keep their old object, so only the ones that were
+    added or changed are new. Events are the expensive one (one request per
+    event), so only new events and events that haven't ended yet are fetched,
+    several at a time.
+    A collection that fails keeps its old data instead of failing the rebuild.
+    '''
+
+    COLLECTIONS = ('cards', 'members', 'events', 'costumes', 'items', 'areaitems', 'assets', 'songs', 'gachas')
+
+    # stop probing for new event ids after this many misses in a row.
+    EVENT_ID_GAP = 20
+    # event ids requested at the same time while probing.
+    EVENT_BATCH = 10
+
+    def __init__(self, repo, db):
+        self.repo = repo
+        self.old = db
+        self.reports = {name : CollectionReport(name) for name in RebuildPipeline.COLLECTIONS}
+
+    async def run(self):
+        '''
+        Returns {collection : new data} for every collection that was fetched.
+        The old db is never modified.
+        '''
+        self.executor = ThreadPoolExecutor(max_workers=len(RebuildPipeline.COLLECTIONS),
+                                           thread_name_prefix='bandori-rebuild')
+        try:
+            results = await asyncio.gather(*[self._collect(name)
+                                             for name in RebuildPipeline.COLLECTIONS])
+        finally:
+            self.executor.shutdown(wait=False)
+
+        return {name : result for name, result in zip(RebuildPipeline.COLLECTIONS, results)
+                if result is not None}
+
+    @property
+    def ok(self):
+        return all(report.error is None for report in self.reports.values())
+
+    def dirty(self, collections):
+        '''
+        The fetched collections that actually changed and need to be saved.
+        '''
+        return {name : data for name, data in collections.items() if self.reports[name].dirty}
+
+    def summary(self):
+        return '\n'.join(str(report) for report in self.reports.values())
+
+    async def _collect(self, name):
+        report = self.reports[name]
+        fetch = getattr(self, f'_fetch_{name}', None) or partial(self._fetch_list, name)
+        start = time.perf_counter()
+
+        try:
+            result = await asyncio.wait_for(fetch(), timeout=self.repo.LONG_TIMEOUT)
+        except Exception as e:
+            logging.error(f'Error while updating {name}.', exc_info=True)
+            report.error = type(e).__name__
+            result = None
+
+        report.seconds = time.perf_counter() - start
+        print(f'Done {name}')
+        return result
+
+    async def _offload(self, func, *args, **kwargs):
+        '''
+        Diffing and loading the old collection off the event loop.
+        '''
+        return await self.repo.run(func, *args, timeout=None, executor=self.executor, **kwargs)
+
+
+    ##### fetchers, the downloads are async, the diffing runs on the rebuild executor.
+
+    async def _fetch_list(self, name):
+        objs = await getattr(self.repo, f'get_{name}')(timeout=self.repo.LONG_TIMEOUT)
+
+        def merge():
+            return self._merge(name, self.old.get(name, []), compact(name, objs))
+
+        return await self._offload(merge)
+
+    async def _fetch_assets(self):
+        assets = await self.repo.get_assets(timeout=self.repo.LONG_TIMEOUT)
+
+        def merge():
+            new = compact('assets', assets)
+            old = self.old.get('assets', {})
+            return {category : self._merge(category, old.get(category, []), objs, report=self.reports['assets'])
+                    for category, objs in new.items()}
+
+        return await self._offload(merge)
+
+    async def _fetch_events(self):
+        old = await self._offload(self.old.get, 'events', [])
+        count = await self.repo.get_event_count()
+        now = datetime.utcnow()
+
+        def settled(event):
+            end = event.get_end_date()
+            return end != -1 and end < now
+
+        # finished events don't change anymore, only look at the others and new ones.
+        keep = [e for e in old if settled(e)]
+        refresh = [e for e in old if not settled(e)]
+        found, failed = await self._get_events([e.id for e in refresh])
+        fetched = list(found.values())
+        # an event is only dropped when the api says it's gone, not when asking failed.
+        keep.extend(e for e in refresh if e.id in failed)
+
+        # probe for ids past the newest one we know about (all of them on a first build),
+        # a batch at a time, until we have them all or run into a long gap.
+        next_id = max([e.id for e in old], default=0) + 1
+        misses = 0
+        while len(keep) + len(fetched) < count and misses < RebuildPipeline.EVENT_ID_GAP:
+            ids = list(range(next_id, next_id + RebuildPipeline.EVENT_BATCH))
+            found, failed = await self._get_events(ids)
+
+            if failed:
+                # keep what comes before the first failure, the next rebuild probes from there again.
+                first = min(failed)
+                fetched.extend(e for id, e in found.items() if id < first)
+                break
+
+            for id in ids:
+                misses = 0 if id in found else misses + 1
+            fetched.extend(found.values())
+            next_id += RebuildPipeline.EVENT_BATCH
+
+        events = sorted(keep + fetched, key=lambda e: e.id)
+        return await self._offload(self._merge, 'events', old, events)
+
+    async def _get_events(self, ids):
+        '''
+        ({id : event} of the ones that exist, set of ids that couldn't be fetched).
+        '''
+        results = await asyncio.gather(*[self.repo.get_event(id) for id in ids], return_exceptions=True)
+        found, failed = {}, set()
+
+        for id, result in zip(ids, results):
+            if isinstance(result, BaseException):
+                logging.warning(f'Could not fetch event {id}, keeping what the db has: {result!r}')
+                failed.add(id)
+            elif result is not None:
+                found[id] = result
+
+        return found, failed
+
+    def _merge(self, name, old, new, report=None):
+        '''
+        New list in api order, reusing the old object for unchanged records.
+        '''
+        report = report or self.reports[name]
+        previous = {obj.id : (record_hash(obj), obj) for obj in old}
+        merged = []
+
+        for obj in new:
+            h = record_hash(obj)
+            before = previous.pop(obj.id, None)
+
+            if before is None:
+                report.added += 1
+                merged.append(obj)
+            elif before[0] != h:
+                report.changed += 1
+                merged.append(obj)
+            else:
+                merged.append(before[1])
+
+        report.removed += len(previous)
+        report.total += len(merged)
+
+        return merged
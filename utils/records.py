@@ -0,0 +1,113 @@
+import sys
+
+
+class Record:
+    '''
+    Compact, read-only stand-in for a pydori object.
+
+    Only keeps the fields the bot actually shows, in __slots__ named after
+    the api keys, with repeated strings interned. No .data dict, no api
+    handle, and it pickles as a plain tuple.
+    '''
+
+    __slots__ = ()
+    INTERNED = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_data(cls, data):
+        values = []
+        for field in cls.__slots__:
+            value = data.get(field)
+            if field in cls.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            values.append(value)
+
+        return cls(*values)
+
+    @property
+    def data(self):
+        '''
+        The kept fields as a dict, like pydori's .data.
+        '''
+        return {field : getattr(self, field) for field in self.__slots__}
+
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, field) for field in self.__slots__))
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} id={self.id}>'
+
+
+class CardRecord(Record):
+    __slots__ = ('id', 'name', 'japanese_name', 'member', 'i_rarity', 'i_attribute', 'i_skill_type',
+                 'skill_name', 'japanese_skill_name', 'full_skill',
+                 'image', 'image_trained', 'art', 'art_trained',
+                 'performance_min', 'performance_max', 'performance_trained_max',
+                 'technique_min', 'technique_max', 'technique_trained_max',
+                 'visual_min', 'visual_max', 'visual_trained_max',
+                 'cameo_members', 'is_promo', 'is_original', 'release_date')
+    INTERNED = ('i_attribute', 'i_skill_type')
+
+
+class MemberRecord(Record):
+    __slots__ = ('id', 'name', 'japanese_name', 'image', 'square_image', 'i_band',
+                 'school', 'i_school_year', 'romaji_CV', 'CV', 'birthday', 'food_like',
+                 'food_dislike', 'i_astrological_sign', 'instrument', 'description')
+    INTERNED = ('i_band', 'school', 'i_school_year', 'i_astrological_sign', 'instrument')
+
+
+class SongRecord(Record):
+    __slots__ = ('id', 'title', 'bandId', 'band_name', 'bgm', 'thumb', 'jacket',
+                 'difficulty', 'how_to_get', 'lyricist', 'composer', 'arranger', 'published_at')
+    INTERNED = ('band_name', 'how_to_get', 'lyricist', 'composer', 'arranger')
+
+    @classmethod
+    def from_song(cls, song):
+        # bandori database keys differ from ours, and the urls are built by pydori.
+        return cls(song.id, song.title, song.band, sys.intern(song.band_name or ''), song.bgm,
+                   song.thumb, song.jacket, song.difficulty, song.how_to_get,
+                   song.lyricist, song.composer, song.arranger, song.published_at)
+
+
+class AssetRecord(Record):
+    __slots__ = ('id', 'i_type', 'name', 'image', 'english_image', 'members',
+                 'i_band', 'c_tags', 'event', 'song')
+    INTERNED = ('i_type', 'i_band')
+
+
+RECORDS = {
+    'cards' : CardRecord,
+    'members' : MemberRecord,
+    'songs' : SongRecord
+}
+
+
+def compact(name, objs):
+    '''
+    Records for a collection of pydori objects. Collections without a record
+    type, and objects that already are records, are returned as they are.
+    '''
+    if name == 'assets':
+        return {category : [o if isinstance(o, Record) else AssetRecord.from_data(o.data) for o in assets]
+                for category, assets in objs.items()}
+
+    record = RECORDS.get(name)
+    if record is None:
+        return objs
+
+    if record is SongRecord:
+        return [o if isinstance(o, Record) else SongRecord.from_song(o) for o in objs]
+
+    return [o if isinstance(o, Record) else record.from_data(o.data) for o in objs]
+
+
+def is_compact(name, objs):
+    if name == 'assets':
+        return all(isinstance(o, Record) for assets in objs.values() for o in assets)
+    if name not in RECORDS:
+        return True
+    return all(isinstance(o, Record) for o in objs)
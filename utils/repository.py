@@ -0,0 +1,238 @@
+from pydori import bandori_api
+from pydori.loader import BandoriLoader
+from pydori.models.ptymodels import (PCard, PMember, PEvent, PCostume, PItem, PAreaItem,
+                                     PComic, PBackground, PStamp, PTitle, PInterface, POfficialArt)
+from pydori.models.gamodels import DSong, DGacha
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlparse
+from utils.metrics import Metrics
+import aiohttp
+import asyncio
+import logging
+import os
+
+
+class NotFound(BandoriLoader.FailedRequest):
+    '''
+    The api answered 404: the object doesn't exist, as opposed to a request that failed.
+    '''
+
+
+class BandoriRepository:
+    '''
+    Async data access layer for the bandori.party and bandori database apis.
+
+    Requests go through the bot's shared http session and are awaited with a
+    timeout, and the json is wrapped in the same pydori models pydori itself
+    would return. Anything blocking that's left (building catalogs, pickling)
+    goes on a dedicated, bounded thread pool through run(), so nothing that
+    goes through here blocks the event loop.
+    '''
+
+    MAX_WORKERS = 4
+    TIMEOUT = 15        # seconds, for single object calls
+    LONG_TIMEOUT = 600  # seconds, for full collection downloads
+
+    ASSET_TYPES = {
+        'comic' : PComic,
+        'background' : PBackground,
+        'stamp' : PStamp,
+        'title' : PTitle,
+        'interface' : PInterface,
+        'officialart' : POfficialArt
+    }
+
+    def __init__(self, http, region='en/', max_workers=MAX_WORKERS, metrics=None):
+        self.http = http
+        self.region = region
+        self.metrics = metrics or Metrics()
+        # only used for their urls now.
+        self.party = bandori_api(region=region)
+        self.ga = bandori_api(region=region, party=False)
+
+        # point the api at another server, like the fake one in bench/fakeapi.py.
+        party_url = os.getenv('BANDORI_PARTY_URL')
+        ga_url = os.getenv('BANDORI_GA_URL')
+        self.res_url = os.getenv('BANDORI_RES_URL')
+        for api in (self.party, self.ga):
+            if party_url:
+                api.URL_PARTY = party_url
+            if ga_url:
+                api.URL_GA = ga_url + region
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='bandori-api')
+
+    async def run(self, func, *args, timeout=TIMEOUT, executor=None, **kwargs):
+        '''
+        Run a blocking callable on the api pool (or the given executor)
+        and wait at most timeout seconds.
+        Raises asyncio.TimeoutError if it takes too long.
+        '''
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(executor or self.executor, partial(func, *args, **kwargs))
+        name = getattr(func, '__name__', type(func).__name__)
+
+        try:
+            with self.metrics.timer('executor_seconds', call=name):
+                return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f'{name} timed out after {timeout}s')
+            raise
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+    ##### raw requests
+
+    @staticmethod
+    def endpoint(url):
+        '''
+        What a url asks for, without ids, e.g. cards or gacha/current. Used as the metrics label.
+        '''
+        parts = [p for p in urlparse(url).path.split('/') if p and not p.isdigit()]
+        if parts and parts[-1] == 'current':
+            return '/'.join(parts[-2:])
+        return parts[-1] if parts else urlparse(url).netloc
+
+    async def get_json(self, url, timeout=TIMEOUT):
+        with self.metrics.timer('api_request_seconds', endpoint=BandoriRepository.endpoint(url)):
+            async with self.http.session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if resp.status == 404:
+                    raise NotFound(f'Nothing at {url}')
+                if resp.status != 200:
+                    raise BandoriLoader.FailedRequest(f'Could not get request from {url}')
+                return await resp.json(content_type=None)
+
+    async def get_pages(self, url, timeout=LONG_TIMEOUT):
+        '''
+        Every result of a paginated bandori.party endpoint.
+        '''
+        async def pages():
+            results = []
+            page = url
+            while page is not None:
+                data = await self.get_json(page)
+                results.extend(data['results'])
+                page = data['next']
+            return results
+
+        return await asyncio.wait_for(pages(), timeout=timeout)
+
+    async def get_list(self, url, timeout=TIMEOUT):
+        '''
+        A bandori database list endpoint, which may be wrapped in {'data': [...]}.
+        '''
+        d = await self.get_json(url, timeout=timeout)
+        if isinstance(d, dict) and d.get('data') is not None:
+            d = d['data']
+        return list(d.values()) if isinstance(d, dict) else list(d)
+
+    async def _party(self, endpoint, model, id=[], timeout=TIMEOUT):
+        url = self.party.URL_PARTY + endpoint
+        if not id:
+            return [model(data) for data in await self.get_pages(url, timeout=max(timeout, self.LONG_TIMEOUT))]
+
+        found = await asyncio.gather(*[self.get_json(url + str(i), timeout=timeout) for i in id])
+        return [model(data) for data in found]
+
+
+    ##### bandori.party
+
+    async def get_cards(self, id=[], timeout=TIMEOUT):
+        return await self._party('cards/', PCard, id, timeout)
+
+    async def get_members(self, id=[], timeout=TIMEOUT):
+        return await self._party('members/', PMember, id, timeout)
+
+    async def get_costumes(self, id=[], timeout=TIMEOUT):
+        return await self._party('costumes/', PCostume, id, timeout)
+
+    async def get_items(self, id=[], timeout=TIMEOUT):
+        return await self._party('items/', PItem, id, timeout)
+
+    async def get_areaitems(self, id=[], timeout=TIMEOUT):
+        return await self._party('areaitems/', PAreaItem, id, timeout)
+
+    async def get_assets(self, timeout=LONG_TIMEOUT):
+        '''
+        All assets, sorted into {category : [assets]} like pydori does.
+        '''
+        assets = {category : [] for category in BandoriRepository.ASSET_TYPES}
+
+        for data in await self.get_pages(self.party.URL_PARTY + 'assets/', timeout=timeout):
+            category = data.get('i_type') if data.get('i_type') in assets else 'officialart'
+            assets[category].append(BandoriRepository.ASSET_TYPES[category](data))
+
+        return assets
+
+    async def get_event_count(self, timeout=TIMEOUT):
+        return (await self.get_json(self.party.URL_PARTY + 'events/', timeout=timeout))['count']
+
+    async def get_event(self, id, timeout=TIMEOUT):
+        '''
+        A party event by id, or None if there is no event with that id.
+        bandori.party event pages don't include their id, so it is added here.
+        Any other failure (FailedRequest, timeouts) is raised, it says nothing about the event.
+        '''
+        try:
+            data = await self.get_json(self.party.URL_PARTY + f'events/{id}', timeout=timeout)
+        except NotFound:
+            return None
+
+        if 'detail' in data:
+            return None
+
+        data['id'] = id
+        return PEvent(data)
+
+    async def get_events(self, id=[], timeout=TIMEOUT):
+        found = await asyncio.gather(*[self.get_event(i, timeout=timeout) for i in id])
+        return [event for event in found if event is not None]
+
+    async def get_current_event(self, timeout=TIMEOUT):
+        event = await self.get_json(self.ga.URL_GA + 'event/', timeout=timeout)
+        id = event['eventId'] + 3  # offset of 3 to get the party event, like pydori.
+
+        return await self.get_event(id, timeout=timeout)
+
+    async def get_event_details(self, event, timeout=TIMEOUT):
+        '''
+        Returns the (main card, boost members) of a party event.
+        '''
+        main, boost = await asyncio.gather(
+            self.get_cards(id=[event.main_card], timeout=timeout),
+            self.get_members(id=event.boost_members or [], timeout=timeout))
+
+        return main[0], boost
+
+
+    ##### bandori database
+
+    async def get_songs(self, timeout=TIMEOUT):
+        return [self._song(data) for data in await self.get_list(self.ga.URL_GA + 'music/', timeout)]
+
+    def _song(self, data):
+        song = DSong(data, region=self.region)
+        if self.res_url:
+            # pydori always builds these from the real resource server.
+            song.bgm = self.res_url + data.get('bgmFile', '')
+            song.thumb = self.res_url + data.get('thumb', '')
+            song.jacket = self.res_url + data.get('jacket', '')
+        return song
+
+    async def get_active_gachas(self, timeout=TIMEOUT):
+        return [DGacha(data, region=self.region) for data in await self.get_list(self.ga.URL_GA + 'gacha/current', timeout)]
+
+    async def get_gachas(self, timeout=TIMEOUT):
+        '''
+        Every gacha. The list is keyed by gacha id, which isn't always in the entries themselves.
+        '''
+        d = await self.get_json(self.ga.URL_GA + 'gacha/', timeout=timeout)
+        if isinstance(d, dict) and d.get('data') is not None:
+            d = d['data']
+        if isinstance(d, dict):
+            return [DGacha(dict(data, gachaId=data.get('gachaId', id)), region=self.region)
+                    for id, data in d.items()]
+        return [DGacha(data, region=self.region) for data in d]
@@ -0,0 +1,154 @@
+from collections import Counter
+from bisect import bisect_left
+from itertools import chain
+import heapq
+import math
+import re
+
+
+def normalize(text):
+    '''
+    Case-folded, with runs of whitespace made a single space.
+    '''
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+def trigrams(text):
+    '''
+    3 character grams of text, padded so the start and end of a word count too.
+    '''
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    '''
+    Name search over one collection.
+
+    Every name (English and Japanese) of every object is kept sorted for
+    prefix lookups with bisect. Substrings are found through character and
+    bigram postings, so they work for any length and for Japanese names,
+    which have no spaces to split on. Typos are found through a trigram
+    index and ranked by trigram similarity.
+
+    Only names that can still match are looked at: substring candidates
+    come from the rarest of the query's bigrams, and fuzzy candidates from
+    just enough of its rarest trigrams that a name sharing MIN_SHARED of
+    them must have one (common trigrams are skipped), and only the
+    MAX_CANDIDATES names sharing the most of those are compared in full.
+    When prefix matches already fill the k results the rest is not
+    searched at all.
+    '''
+
+    # share of the query's trigrams a name needs to have to match at all.
+    MIN_SHARED = 0.5
+    # names compared with the query in full per fuzzy search, keeps it fast when names share common words.
+    MAX_CANDIDATES = 128
+
+    # scores, higher ranks first. Fuzzy matches score their trigram similarity (jaccard, < 1).
+    EXACT = 4.0
+    PREFIX = 3.0
+    SUBSTRING = 2.0
+
+    def __init__(self, objs, attrs):
+        self.objs = list(objs)
+        self.names = []     # (normalized name, object position)
+        self.grams = {}     # trigram : [name positions]
+        self.pairs = {}     # bigram : [name positions]
+        self.chars = {}     # character : [name positions]
+        self.sizes = []     # number of trigrams of each name
+
+        for pos, obj in enumerate(self.objs):
+            for attr in attrs:
+                name = getattr(obj, attr, None)
+                if name:
+                    self.names.append((normalize(name), pos))
+
+        for i, (name, _) in enumerate(self.names):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.grams.setdefault(gram, []).append(i)
+            for pair in {name[j:j + 2] for j in range(len(name) - 1)}:
+                self.pairs.setdefault(pair, []).append(i)
+            for char in set(name):
+                self.chars.setdefault(char, []).append(i)
+
+        self.sorted = sorted(self.names)
+
+    def search(self, query, k=5):
+        '''
+        Up to k objects whose name matches query, best first.
+        Exact matches go before prefix matches, then substring matches,
+        then names that are only similar.
+        '''
+        if query is None:
+            return []
+        query = normalize(query)
+        if not query:
+            return []
+
+        scores = {}
+
+        def score(pos, value):
+            if value > scores.get(pos, 0):
+                scores[pos] = value
+
+        def best():
+            top = heapq.nsmallest(k, scores.items(), key=lambda s: (-s[1], s[0]))
+            return [self.objs[pos] for pos, _ in top]
+
+        # prefixes: everything sorted from the query up to the last name starting with it.
+        i = bisect_left(self.sorted, (query,))
+        while i < len(self.sorted) and self.sorted[i][0].startswith(query):
+            name, pos = self.sorted[i]
+            # the closer the name is to the query, the higher it ranks.
+            score(pos, SearchIndex.EXACT if name == query else SearchIndex.PREFIX + len(query) / len(name))
+            i += 1
+
+        # anything else scores lower than a prefix match.
+        if len(scores) >= k:
+            return best()
+
+        found = self.substrings(query)
+        for i in found:
+            name, pos = self.names[i]
+            score(pos, SearchIndex.SUBSTRING + len(query) / len(name))
+
+        if len(scores) >= k:
+            return best()
+
+        # typos: names sharing at least MIN_SHARED of the query's trigrams.
+        query_grams = trigrams(query)
+        needed = math.ceil(len(query_grams) * SearchIndex.MIN_SHARED)
+        rarest = sorted(query_grams, key=lambda gram: len(self.grams.get(gram, ())))
+        rare, common = rarest[:len(query_grams) - needed + 1], rarest[len(query_grams) - needed + 1:]
+        candidates = Counter(chain.from_iterable(self.grams.get(gram, ()) for gram in rare))
+        found = set(found)
+
+        for i, shared in candidates.most_common(SearchIndex.MAX_CANDIDATES):
+            if i in found:
+                continue
+            name, pos = self.names[i]
+            # the common trigrams weren't counted, look them up in the name (padded like trigrams()).
+            padded = f'  {name} '
+            shared += sum(1 for gram in common if gram in padded)
+            if shared >= needed:
+                score(pos, shared / (len(query_grams) + self.sizes[i] - shared))
+
+        return best()
+
+    def substrings(self, query):
+        '''
+        Positions (in self.names) of the names containing query.
+        '''
+        if len(query) == 1:
+            return self.chars.get(query, [])
+
+        # a name containing the query has all of its bigrams, start from the two rarest.
+        postings = sorted((self.pairs.get(query[j:j + 2], ()) for j in range(len(query) - 1)), key=len)
+        candidates = set(postings[0])
+        if len(postings) > 1:
+            candidates.intersection_update(postings[1])
+
+        return [i for i in candidates if query in self.names[i][0]]
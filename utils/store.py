@@ -0,0 +1,111 @@
+from collections.abc import Mapping
+import _pickle as pickle
+import logging
+import threading
+import os
+
+
+class CollectionStore:
+    '''
+    On-disk db, one pickle file per collection.
+
+    Writes go to a temporary file that is then renamed over the old one,
+    so a crash mid-write never loses a collection, and a corrupt file
+    only loses that one collection.
+    '''
+
+    SUFFIX = '.pickle'
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, name):
+        return os.path.join(self.path, name + CollectionStore.SUFFIX)
+
+    def names(self):
+        return [f[:-len(CollectionStore.SUFFIX)] for f in os.listdir(self.path)
+                if f.endswith(CollectionStore.SUFFIX)]
+
+    def __contains__(self, name):
+        return os.path.isfile(self.file(name))
+
+    def load(self, name):
+        logging.info(f'Loading {name} from {self.path}')
+        with open(self.file(name), 'rb') as handle:
+            return pickle.load(handle)
+
+    def save(self, name, obj):
+        path = self.file(name)
+        with open(path + '.tmp', 'wb') as handle:
+            pickle.dump(obj, handle, protocol=4)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        os.replace(path + '.tmp', path)
+
+    def save_all(self, collections):
+        for name, obj in collections.items():
+            self.save(name, obj)
+
+    def migrate(self, legacy):
+        '''
+        Split an old single-file database.pickle into this store.
+        '''
+        logging.warning(f'Migrating {legacy} to {self.path}')
+        with open(legacy, 'rb') as handle:
+            self.save_all(pickle.load(handle))
+
+
+class LazyDatabase(Mapping):
+    '''
+    Read-only dict of collections that only unpickles a collection the
+    first time it is accessed. Safe to access from executor threads.
+
+    transform(name, collection) is applied once to every collection loaded from disk.
+    '''
+
+    def __init__(self, store, loaded=None, transform=None):
+        self.store = store
+        self.loaded = dict(loaded or {})
+        self.transform = transform
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        try:
+            return self.loaded[name]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if name not in self.loaded:
+                if name not in self.store:
+                    raise KeyError(name)
+                collection = self.store.load(name)
+                if self.transform is not None:
+                    collection = self.transform(name, collection)
+                self.loaded[name] = collection
+
+            return self.loaded[name]
+
+    def __iter__(self):
+        return iter(set(self.store.names()) | set(self.loaded))
+
+    def __len__(self):
+        return len(set(self.store.names()) | set(self.loaded))
+
+    def is_loaded(self, name):
+        return name in self.loaded
+
+    def warm(self, names):
+        '''
+        Load these collections now, blocking. Meant to be run in an executor.
+        '''
+        for name in names:
+            self.get(name)
+
+    def updated(self, collections):
+        '''
+        New LazyDatabase over the same store with some collections replaced.
+        '''
+        return LazyDatabase(self.store, {**self.loaded, **collections}, self.transform)